@@ -1,57 +1,104 @@
 from pyserini.search import LuceneSearcher
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
 from sentence_transformers import CrossEncoder
+import numpy as np
 import json
 import argparse
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import torch
 
-
-def generate_response(top_docs, searcher, device, model: AutoModelForSeq2SeqLM, tokenizer: AutoTokenizer):
-    passages = [json.loads(searcher.doc(hit.docid).raw())['contents'] for hit in top_docs]
-    text = ' '.join(passages)
-    inputs = tokenizer.encode("summarize: " + text, return_tensors="pt", max_length=512, truncation=True).to(device)
+# inputs are padded to a multiple of this many tokens so that a compiled model
+# only sees a small number of distinct input shapes (up to the 512 token limit)
+PAD_TO_MULTIPLE_OF = 64
+# the padding actually applied when tokenizing the T5 inputs. It's only set to
+# PAD_TO_MULTIPLE_OF with --compile, since uncompiled models gain nothing from it
+pad_to_multiple_of = None
+
+
+def beam_search_kwargs(num_beams: int):
+    # The length penalty and early stopping only apply to beam search, so they're
+    # left out when decoding greedily with a single beam
+    if num_beams > 1:
+        return {"num_beams": num_beams, "length_penalty": 2.0, "early_stopping": True}
+    return {"num_beams": 1}
+
+
+def compile_model(model: AutoModelForSeq2SeqLM, tokenizer: AutoTokenizer, device, num_beams: int = 4):
+    """
+    Compile the forward pass of a seq2seq model with torch.compile.
+
+    "reduce-overhead" mode captures CUDA graphs around each decoder step, which
+    removes most of the per-token kernel launch overhead during generate(). A dummy
+    generate() call is made to warm up the compilation cache before the model is used.
+    """
+    model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False)
+    inputs = tokenizer(["warm up"], return_tensors="pt", padding=True,
+                       pad_to_multiple_of=PAD_TO_MULTIPLE_OF).to(device)
+    with torch.no_grad():
+        model.generate(**inputs, max_length=250, num_beams=num_beams)
+    return model
+
+
+def fetch_doc_texts(hits, searcher):
+    # Fetch the contents of each hit from the index once, so the text can be
+    # shared between response generation and the run file provenance entries
+    return {hit.docid: json.loads(searcher.doc(hit.docid).raw())['contents'] for hit in hits}
+
+
+def generate_response(passage_groups, doc_texts, device, model: AutoModelForSeq2SeqLM, tokenizer: AutoTokenizer,
+                      num_beams: int = 4):
+    # Summarize each group of passages into a response. The groups are independent
+    # of each other, so they're all tokenized and passed to the model as one batch
+    texts = [
+        "summarize: " + ' '.join([doc_texts[hit.docid] for hit in top_docs])
+        for top_docs in passage_groups
+    ]
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, max_length=512, truncation=True,
+                       pad_to_multiple_of=pad_to_multiple_of).to(device)
     with torch.no_grad():
         summary_ids = model.generate(
-            inputs,
+            **inputs,
             max_length=250,
             min_length=50,
-            length_penalty=2.0,
-            num_beams=4,
-            early_stopping=True
+            **beam_search_kwargs(num_beams)
         )
-    summary = tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-    return summary
+    return tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
 
 
 def get_ptkb_statements(query, num_ptkb, ptkb, reranker):
-    # Find the similarity of PTKB statements with the given query
-    similarity_scores = [reranker.predict([[query, ptkb_statement]])[0] for ptkb_statement in ptkb.values()]
-
-    # Pair each statement with its similarity score
-    statement_score_pairs = list(zip(list(ptkb.values()), similarity_scores))
-
-    # Sort the pairs based on the similarity scores in descending order
-    sorted_pairs = sorted(statement_score_pairs, key=lambda x: x[1], reverse=True)
-
-    # Extract the sorted responses
-    sorted_ptkb_statements = [pair[0] for pair in sorted_pairs]
-
-    # Return required number of PTKB statements
-    return ' '.join(sorted_ptkb_statements[:num_ptkb])
-
-
-def rewrite_utterance(context, utterance, num_ptkb, ptkb, device, reranker, model, tokenizer):
+    statements = list(ptkb.values())
+    # CrossEncoder.predict fails on an empty list, so topics without a PTKB are handled here
+    if len(statements) == 0:
+        return ''
+
+    # Find the similarity of PTKB statements with the given query, scoring
+    # all the (query, statement) pairs in a single batch
+    similarity_scores = reranker.predict(
+        [[query, ptkb_statement] for ptkb_statement in statements],
+        batch_size=32,
+        show_progress_bar=False
+    )
+
+    # Sort the statements based on the similarity scores in descending order
+    # and return the required number of PTKB statements
+    top_indices = np.argsort(-np.asarray(similarity_scores), kind='stable')[:num_ptkb]
+    return ' '.join([statements[i] for i in top_indices])
+
+
+def rewrite_utterance(context, utterance, num_ptkb, ptkb, device, reranker, model, tokenizer, num_beams=4):
     input_text = "{} ||| {}".format(context, utterance)
-    input_ids = tokenizer.encode(input_text, return_tensors="pt").to(device)
+    # The context grows with every turn, so the input is truncated to the model's
+    # limit. The tokenizer truncates from the left, keeping the current utterance
+    inputs = tokenizer([input_text], return_tensors="pt", padding=True, max_length=512, truncation=True,
+                       pad_to_multiple_of=pad_to_multiple_of).to(device)
     with torch.no_grad():
         output_ids = model.generate(
-            input_ids,
+            **inputs,
             max_length=250,
-            length_penalty=2.0,
-            num_beams=4,
-            early_stopping=True
+            **beam_search_kwargs(num_beams)
         )
 
     rewritten_utterance = tokenizer.decode(output_ids[0], skip_special_tokens=True)
@@ -66,77 +113,79 @@ def rewrite_utterance(context, utterance, num_ptkb, ptkb, device, reranker, mode
     return rewritten_utterance
 
 
-def prepare_output_for_json(turn_id, sorted_responses, sorted_hits, searcher, res):
+def prepare_output_for_json(turn_id, sorted_responses, sorted_hits, doc_texts, res):
+    # The passage texts come from doc_texts, which was filled in when the
+    # responses were generated, rather than being fetched from the index again
     turn_data = {
         "turn_id": turn_id,
-        "responses": []
+        "responses": [
+            {
+                "rank": rank,
+                "text": response,
+                "passage_provenance": [
+                    {
+                        "id": hit.docid,
+                        "text": doc_texts[hit.docid],
+                        "score": hit.score
+                    } for hit in hits
+                ]
+            } for rank, (response, hits) in enumerate(zip(sorted_responses, sorted_hits), start=1)
+        ]
     }
 
-    for i in range(len(sorted_responses)):
-        response_data = {
-            "rank": i + 1,
-            "text": sorted_responses[i],
-            "passage_provenance": [
-                {
-                    "id": hit.docid,
-                    "text": json.loads(searcher.doc(hit.docid).raw())['contents'],
-                    "score": hit.score
-                } for hit in sorted_hits[i]
-            ]
-        }
-        turn_data["responses"].append(response_data)
-
     res["turns"].append(turn_data)
 
 
 def official_search(
         query_id: str,
         query: str,
-        k: int,
-        searcher: LuceneSearcher,
+        hits,
+        doc_texts,
         res,
         num_response: int,
         num_psg: int,
         device,
         reranker: CrossEncoder,
         summarizer: AutoModelForSeq2SeqLM,
-        tokenizer: AutoTokenizer
+        tokenizer: AutoTokenizer,
+        num_beams: int = 4
 ):
-    hits = searcher.search(q=query, k=k)
     if len(hits) != 0:
         top_docs_for_generating_response = [hits[i:i + num_psg] for i in range(0, len(hits), num_psg)]
 
         # Based on num_response asked, we generate responses
-        responses = [generate_response(
-            top_docs=top_docs_for_generating_response[i],
+        responses = generate_response(
+            passage_groups=top_docs_for_generating_response[:num_response],
+            doc_texts=doc_texts,
             model=summarizer,
             tokenizer=tokenizer,
-            searcher=searcher,
-            device=device
-        ) for i in range(num_response)]
-
-        # Now we rank these responses by their semantic similarity to the query
-        similarity_scores = [reranker.predict([[query, response]])[0] for response in responses]
-
-        # Pair each response with its subset of hits and its similarity score
-        triplets = [
-            (responses[i], top_docs_for_generating_response[i], similarity_scores[i])
-            for i in range(num_response)
-        ]
+            device=device,
+            num_beams=num_beams
+        )
 
-        # Sort the triplets based on the similarity scores in descending order
-        sorted_triplets = sorted(triplets, key=lambda x: x[2], reverse=True)
+        if len(responses) > 1:
+            # Now we rank these responses by their semantic similarity to the query
+            similarity_scores = reranker.predict(
+                [[query, response] for response in responses],
+                batch_size=32,
+                show_progress_bar=False
+            )
 
-        # Extract the sorted responses and their corresponding subset of hits
-        sorted_responses = [triplet[0] for triplet in sorted_triplets]
-        sorted_hits = [triplet[1] for triplet in sorted_triplets]
+            # Sort the responses and their corresponding subset of hits based on
+            # the similarity scores in descending order
+            order = np.argsort(-np.asarray(similarity_scores), kind='stable')
+        else:
+            # A single response doesn't need to be ranked
+            order = range(len(responses))
+        sorted_responses = [responses[i] for i in order]
+        sorted_hits = [top_docs_for_generating_response[i] for i in order]
 
         # Prepare output data for run file
         prepare_output_for_json(
             turn_id=query_id,
             sorted_responses=sorted_responses,
             sorted_hits=sorted_hits,
-            searcher=searcher,
+            doc_texts=doc_texts,
             res=res
         )
     else:
@@ -144,14 +193,13 @@ def official_search(
         print('Query: {}'.format(query))
 
 
-def trec_search(query_id: str, query: str, k: int, searcher: LuceneSearcher, res, tag: str):
-    hits = searcher.search(q=query, k=k)
+def trec_search(query_id: str, hits, res, tag: str):
     for i in range(len(hits)):
         res.append('{} Q0 {} {} {} {}'.format(query_id, hits[i].docid, i + 1, hits[i].score, tag))
 
 
 def get_query(turn, run_type, num_ptkb, ptkb, device, reranker=None, rewriter=None, tokenizer=None,
-              previous_utterance=None):
+              previous_utterance=None, num_beams=4):
     if run_type == 'automatic':
         utterance = turn['utterance']
         return rewrite_utterance(
@@ -162,7 +210,8 @@ def get_query(turn, run_type, num_ptkb, ptkb, device, reranker=None, rewriter=No
             num_ptkb=num_ptkb,
             ptkb=ptkb,
             reranker=reranker,
-            device=device
+            device=device,
+            num_beams=num_beams
         )
     else:
         ptkb_provenance = turn['ptkb_provenance']
@@ -173,12 +222,48 @@ def get_query(turn, run_type, num_ptkb, ptkb, device, reranker=None, rewriter=No
         return turn['resolved_utterance']
 
 
+def get_conversation_queries(conversation, run_type, num_ptkb, previous_turns, device, reranker=None, rewriter=None,
+                             tokenizer=None, num_beams=4):
+    # Build the queries for all the turns in a conversation, so that retrieval
+    # for the whole conversation can be done with a single batch_search
+    query_ids = []
+    queries = []
+    for turn in conversation['turns']:
+        query_ids.append(conversation['number'] + '_' + str(turn['turn_id']))
+        queries.append(get_query(
+            turn=turn,
+            run_type=run_type,
+            num_ptkb=num_ptkb,
+            rewriter=rewriter,
+            tokenizer=tokenizer,
+            ptkb=conversation['ptkb'],
+            previous_utterance=''.join(previous_turns),
+            reranker=reranker,
+            device=device,
+            num_beams=num_beams
+        ))
+
+        if run_type == 'automatic':
+            previous_turns.append(" ||| " + turn['utterance'] + " ||| " + turn['response'])
+    return query_ids, queries
+
+
+def retrieve(query_ids, queries, k, threads, num_docs, searcher: LuceneSearcher):
+    # Retrieve the hits for a set of queries, along with the texts of the top
+    # num_docs hits of each query which are used to generate the responses
+    batch_hits = searcher.batch_search(queries=queries, qids=query_ids, k=k, threads=threads)
+    doc_texts = {query_id: fetch_doc_texts(batch_hits[query_id][:num_docs], searcher) for query_id in query_ids}
+    return batch_hits, doc_texts
+
+
 def main():
     parser = argparse.ArgumentParser("Search using Pyserini.")
     parser.add_argument("--data", help='JSON file of data.', required=True)
     parser.add_argument("--index", help='Path to index.', required=True)
     parser.add_argument('--save', help='File to save.')
     parser.add_argument('--k', help='Number of documents to retrieve. Default: 100.', default=100, type=int)
+    parser.add_argument('--threads', help='Number of threads to use for batch retrieval. Default: 8.', default=8,
+                        type=int)
     parser.add_argument('--ret-model', help='Retrieval model to use. Default: BM25.', default='bm25', type=str)
     parser.add_argument('--res-type', help='Type of result file (trec|official). Default: trec.', default='trec',
                         type=str)
@@ -190,11 +275,27 @@ def main():
                         type=str)
     parser.add_argument('--num-ptkb', help='Top-K PTKB statements to use for query rewriting. Default: 0.',
                         default=0, type=int)
+    parser.add_argument('--context-turns', help='Number of previous turns to use as context for query rewriting. '
+                                                'Default: all.', default=None, type=int)
+    parser.add_argument('--summarizer-beams', help='Number of beams to use for response generation. Default: 4.',
+                        default=4, type=int)
+    parser.add_argument('--rewriter-beams', help='Number of beams to use for query rewriting. Default: 4.',
+                        default=4, type=int)
     parser.add_argument('--rm3', help='Whether or not to use RM3 query expansion. Default: False.', action='store_true')
     parser.add_argument('--cuda', help='CUDA device number. Default: 0.', type=int, default=0)
     parser.add_argument('--use-cuda', help='Whether or not to use CUDA. Default: False.', action='store_true')
+    parser.add_argument('--half', help='Whether or not to run the models in half precision on CUDA. Default: False.',
+                        action='store_true')
+    parser.add_argument('--compile', help='Whether or not to compile the T5 models with torch.compile. Default: False.',
+                        action='store_true')
+    parser.add_argument('--better-transformer', help='Whether or not to convert the reranker to BetterTransformer '
+                                                     '(requires optimum). Default: False.', action='store_true')
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
 
+    if args.compile:
+        global pad_to_multiple_of
+        pad_to_multiple_of = PAD_TO_MULTIPLE_OF
+
     summarizer = None
     summarizer_tokenizer = None
     reranker = None
@@ -204,6 +305,17 @@ def main():
 
     device = torch.device(cuda_device if torch.cuda.is_available() and args.use_cuda else 'cpu')
     print('Using device: {}'.format(device))
+
+    # T5 is prone to overflowing in float16, so it's only run in half precision
+    # if the GPU supports bfloat16. The cross-encoder always uses float16, since
+    # CrossEncoder.predict converts its scores to numpy, which has no bfloat16
+    t5_dtype = torch.float32
+    reranker_dtype = torch.float32
+    if args.half and device.type == 'cuda':
+        reranker_dtype = torch.float16
+        if torch.cuda.is_bf16_supported():
+            t5_dtype = torch.bfloat16
+    print('T5 dtype ==> {}, Reranker dtype ==> {}'.format(t5_dtype, reranker_dtype))
     print('Run Type ==> {}'.format(args.run_type))
     print('Result Type ==> {}'.format(args.res_type))
     print('Top-K PTKB statements to use for query rewriting ==> {}'.format(args.num_ptkb))
@@ -211,17 +323,28 @@ def main():
     print('Number of passages to use for response generation ==> {}'.format(args.num_psg))
 
     if args.res_type == 'official':
-        summarizer = AutoModelForSeq2SeqLM.from_pretrained('mrm8488/t5-base-finetuned-summarize-news')
+        summarizer = AutoModelForSeq2SeqLM.from_pretrained('mrm8488/t5-base-finetuned-summarize-news',
+                                                           torch_dtype=t5_dtype)
         summarizer_tokenizer = AutoTokenizer.from_pretrained('mrm8488/t5-base-finetuned-summarize-news')
         reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+        reranker.model.to(reranker_dtype)
+        if args.better_transformer:
+            # optimum is only needed for this option, so it's imported here
+            from optimum.bettertransformer import BetterTransformer
+            reranker.model = BetterTransformer.transform(reranker.model, keep_original_model=False)
+            print('Reranker converted to BetterTransformer')
         summarizer.to(device)
+        if args.compile:
+            summarizer = compile_model(summarizer, summarizer_tokenizer, device, args.summarizer_beams)
         print('Summarizer ==> mrm8488/t5-base-finetuned-summarize-news')
         print('Reranker ==> cross-encoder/ms-marco-MiniLM-L-6-v2')
 
     if args.run_type == 'automatic':
-        rewriter = AutoModelForSeq2SeqLM.from_pretrained('castorini/t5-base-canard')
+        rewriter = AutoModelForSeq2SeqLM.from_pretrained('castorini/t5-base-canard', torch_dtype=t5_dtype)
         rewriter.to(device)
-        rewriter_tokenizer = AutoTokenizer.from_pretrained('castorini/t5-base-canard')
+        rewriter_tokenizer = AutoTokenizer.from_pretrained('castorini/t5-base-canard', truncation_side='left')
+        if args.compile:
+            rewriter = compile_model(rewriter, rewriter_tokenizer, device, args.rewriter_beams)
         print('Rewriter ==> castorini/t5-base-canard')
 
     print('Loading data...')
@@ -250,53 +373,68 @@ def main():
         res = []
 
     print('Performing search...')
-    previous_utterance = ""
-    for idx, d in enumerate(data):
-        print('========PROCESSING CONVERSATION-{} OF {}=============='.format(idx + 1, len(data)))
-        number = d['number']
-        turns = d['turns']
-        ptkb = d['ptkb']
-        for turn in tqdm(turns, total=len(turns)):
-            turn_id = turn['turn_id']
-            query_id = number + '_' + str(turn_id)
-            query = get_query(
-                turn=turn,
-                run_type=args.run_type,
-                num_ptkb=args.num_ptkb,
-                rewriter=rewriter,
-                tokenizer=rewriter_tokenizer,
-                ptkb=ptkb,
-                previous_utterance=previous_utterance,
-                reranker=reranker,
-                device=device
-            )
+    # Each entry holds the utterance and response of a previous turn. With
+    # --context-turns only that many of the most recent turns are kept
+    previous_turns = deque(maxlen=args.context_turns)
+    num_docs = args.num_response * args.num_psg if args.res_type == 'official' else 0
+
+    def conversation_queries(conversation):
+        return get_conversation_queries(
+            conversation=conversation,
+            run_type=args.run_type,
+            num_ptkb=args.num_ptkb,
+            previous_turns=previous_turns,
+            rewriter=rewriter,
+            tokenizer=rewriter_tokenizer,
+            reranker=reranker,
+            device=device,
+            num_beams=args.rewriter_beams
+        )
 
-            if args.res_type == 'official':
-                official_search(
-                    query_id=query_id,
-                    query=query,
-                    k=args.k,
-                    searcher=searcher,
-                    res=res,
-                    num_response=args.num_response,
-                    num_psg=args.num_psg,
-                    reranker=reranker,
-                    summarizer=summarizer,
-                    tokenizer=summarizer_tokenizer,
-                    device=device
-                )
-            else:  # trec
-                trec_search(
-                    query_id=query_id,
-                    query=query,
-                    k=args.k,
-                    searcher=searcher,
-                    res=res,
-                    tag=args.run_name
-                )
-
-            if args.run_type == 'automatic':
-                previous_utterance += " ||| " + turn['utterance'] + " ||| " + turn['response']
+    # Retrieval runs on a background thread one conversation ahead, so searching
+    # the index for the next conversation overlaps with generating the responses
+    # for the current one on the GPU
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        if len(data) > 0:
+            next_queries = conversation_queries(data[0])
+            next_retrieval = executor.submit(retrieve, *next_queries, args.k, args.threads, num_docs, searcher)
+
+        for idx in range(len(data)):
+            print('========PROCESSING CONVERSATION-{} OF {}=============='.format(idx + 1, len(data)))
+            query_ids, queries = next_queries
+            retrieval = next_retrieval
+            has_next = idx + 1 < len(data)
+            # The next conversation's queries are built while this one is being retrieved
+            if has_next:
+                next_queries = conversation_queries(data[idx + 1])
+            batch_hits, batch_doc_texts = retrieval.result()
+            if has_next:
+                next_retrieval = executor.submit(retrieve, *next_queries, args.k, args.threads, num_docs, searcher)
+
+            for query_id, query in tqdm(zip(query_ids, queries), total=len(queries)):
+                hits = batch_hits[query_id]
+                if args.res_type == 'official':
+                    official_search(
+                        query_id=query_id,
+                        query=query,
+                        hits=hits,
+                        doc_texts=batch_doc_texts[query_id],
+                        res=res,
+                        num_response=args.num_response,
+                        num_psg=args.num_psg,
+                        reranker=reranker,
+                        summarizer=summarizer,
+                        tokenizer=summarizer_tokenizer,
+                        device=device,
+                        num_beams=args.summarizer_beams
+                    )
+                else:  # trec
+                    trec_search(
+                        query_id=query_id,
+                        hits=hits,
+                        res=res,
+                        tag=args.run_name
+                    )
     print('[Done].')
 
     print('Writing to run file...')
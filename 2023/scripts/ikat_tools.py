@@ -135,7 +135,8 @@ def ikat_segmenter_worker(worker_id: int, line_queue: Queue, gen_trecweb: bool,
             print(f'Worker {worker_id} found empty queue, exiting')
             break
 
-        d = json.loads(line.strip())
+        # get_next_line has already stripped the line
+        d = json.loads(line)
         # titles seem to be the first line of the Clean-Text field
         title = d['Clean-Text'].split('\n')[0]
         # URLs have a trailing newline to remove
@@ -206,6 +207,10 @@ def ikat_segmenter(args):
         raise Exception(f'No input files found in {args.input}')
 
     print(f'Found {len(input_files)} data files in {args.input}')
+
+    # check the spaCy model is installed before starting the workers, so if it's
+    # missing that's reported once here instead of by each of the workers
+    SpacyPassageChunker.load_model()
     
     file_handles = [open_file(f) for f in input_files]
     # a multiprocess Queue object used to send data to the worker processes
@@ -316,7 +321,8 @@ def ikat_verify_hashes(args):
                     if len(line) == 0:
                         break
 
-                    data = json.loads(line.strip())
+                    # json.loads ignores the trailing newline, so the line doesn't need to be stripped
+                    data = json.loads(line)
 
                     passage_id = data['id']
                     assert(passage_id in existing_hashes)
@@ -13,6 +13,7 @@ test_root = os.path.dirname(__file__)
 sys.path.append(os.path.join(test_root, 'compiled_protobufs'))
 
 from passage_validator import PassageValidator as PassageValidatorServicer
+from passage_validator_servicer import DEFAULT_WORKERS
 from passage_validator_pb2_grpc import add_PassageValidatorServicer_to_server
 from passage_id_db import PassageIDDatabase, IKAT_PASSAGE_COUNT
 from main import load_run_file, get_stub, GRPC_DEFAULT_TIMEOUT
@@ -121,7 +122,7 @@ def grpc_stub_full(grpc_server_full):
 
 @pytest.fixture
 def grpc_server_test(servicer_params_test):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=DEFAULT_WORKERS))
     add_PassageValidatorServicer_to_server(PassageValidatorServicer(*servicer_params_test), server)
 
     server.add_insecure_port("[::]:8099")
@@ -132,7 +133,7 @@ def grpc_server_test(servicer_params_test):
 
 @pytest.fixture
 def grpc_server_test_invalid(servicer_params_test):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=DEFAULT_WORKERS))
     add_PassageValidatorServicer_to_server(PassageValidatorServicer(*servicer_params_test), server)
 
     server.add_insecure_port("[::]:8999")
@@ -143,7 +144,7 @@ def grpc_server_test_invalid(servicer_params_test):
 
 @pytest.fixture
 def grpc_server_full_alt(servicer_params_full):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=DEFAULT_WORKERS))
     add_PassageValidatorServicer_to_server(PassageValidatorServicer(*servicer_params_full), server)
 
     server.add_insecure_port("[::]:8199")
@@ -154,7 +155,7 @@ def grpc_server_full_alt(servicer_params_full):
 
 @pytest.fixture(scope='module')
 def grpc_server_full(servicer_params_full):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=DEFAULT_WORKERS))
     add_PassageValidatorServicer_to_server(PassageValidatorServicer(*servicer_params_full), server)
 
     server.add_insecure_port("[::]:8000")
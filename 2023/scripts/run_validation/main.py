@@ -1,5 +1,4 @@
 import argparse
-import json
 import logging
 import os
 import sys
@@ -7,9 +6,16 @@ from pathlib import PurePath
 from typing import Tuple, Union, Any, List
 
 import grpc
+from google.protobuf.internal import api_implementation
 from google.protobuf.json_format import ParseDict
 
-from utils import check_passage_provenance, check_ptkb_provenance, check_response, validate_passages
+# orjson parses large run files much faster than the json module, but it's optional
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from utils import ValidationFatal, check_passage_provenances, check_passages, check_ptkb_provenance, check_response, validate_passages, validate_passages_bulk
 
 sys.path.append('./compiled_protobufs')
 from passage_validator_pb2_grpc import PassageValidatorStub
@@ -56,7 +62,8 @@ def load_topic_data(path: str) -> dict[str, dict[str, Any]]:
         raise Exception(f'Topics file {path} not found!')
 
     try:
-        topic_data = json.load(open(path, 'r'))
+        with open(path, 'rb') as topic_file:
+            topic_data = json_loads(topic_file.read())
     except Exception as e:
         logger.error(f'Failed to load topics JSON data from {path}, exception: {e}')
         sys.exit(255)
@@ -66,7 +73,7 @@ def load_topic_data(path: str) -> dict[str, dict[str, Any]]:
         logger.error(f'Topics file not loaded correctly (found {len(topic_data)} entries, expected {EXPECTED_TOPIC_ENTRIES})')
         sys.exit(255)
 
-    total_turns = sum(len(topic_data[i]['turns']) for i in range(len(topic_data)))
+    total_turns = sum(len(topic['turns']) for topic in topic_data)
     if total_turns != EXPECTED_RUN_TURN_COUNT:
         logger.error(f'Topics file not loaded correctly (found {total_turns} turns, expected {EXPECTED_RUN_TURN_COUNT} turns)')
 
@@ -87,9 +94,9 @@ def load_run_file(run_file_path: str) -> iKATRun:
     Returns a populated iKATRun object (see protocol_buffers/run.proto).
     """
     # validate structure
-    with open(run_file_path, 'r', encoding='utf-8') as run_file:
+    with open(run_file_path, 'rb') as run_file:
         try:
-            run = json.load(run_file)
+            run = json_loads(run_file.read())
             # check for expected attributes
             if 'run_name' not in run or 'run_type' not in run:
                 raise Exception('Missing run_name/run_type entry')
@@ -104,19 +111,24 @@ def load_run_file(run_file_path: str) -> iKATRun:
 
     return run
 
-def validate_turn(turn: Turn, ptkb_data: dict[str, Any], stub: Union[None, PassageValidatorStub], timeout: float) -> Tuple[int, int]:
+def validate_turn(turn: Turn, ptkb_data: dict[str, Any], stub: Union[None, PassageValidatorStub], timeout: float, passage_validity: Union[None, dict[str, bool]] = None) -> Tuple[int, int]:
     """
     Validate a single turn from a run.
 
+    If passage_validity is given, the passage IDs in the turn are checked against
+    it (see utils.validate_passages_bulk) instead of calling the validation service.
+
     Returns a 2-tuple of (number of warnings, number of service errors)
     """
     warning_count, service_errors = 0, 0
 
-    logger.debug(f'Validating turn {turn.turn_id}')
+    logger.debug('Validating turn %s', turn.turn_id)
     previous_rank = 0
 
+    if passage_validity is not None:
+        warning_count += check_passages(passage_validity, logger, turn)
     # will be None if skip_passage_validation was used
-    if stub is not None:
+    elif stub is not None:
         try:
             # if passage validation is enabled, this is where we make a gRPC call to the 
             # validation service to perform the passage ID checks
@@ -129,28 +141,23 @@ def validate_turn(turn: Turn, ptkb_data: dict[str, Any], stub: Union[None, Passa
         # check the response:
         warning_count += check_response(response, logger, previous_rank, turn.turn_id)
 
-        previous_score = 1e9
-
-        # check passage provenances
-        for provenance in response.passage_provenance:
-            warning_count += check_passage_provenance(previous_score, provenance, logger, turn.turn_id)
-            previous_score = provenance.score
+        # check passage provenances, counting the ones marked as used in the same pass
+        provenance_warnings, passages_used = check_passage_provenances(response.passage_provenance, logger, turn.turn_id)
+        warning_count += provenance_warnings
 
-        passages_used = [p.used for p in response.passage_provenance if p.used]
-
-        if len(passages_used) == 0:
-            logger.warning(f'Turn {turn.turn_id}, response #{i} has no passages marked as "used"! The top 5 passages will be used as provenance by default')
+        if passages_used == 0:
+            logger.warning('Turn %s, response #%d has no passages marked as "used"! The top 5 passages will be used as provenance by default', turn.turn_id, i)
             warning_count += 1
 
         if len(response.passage_provenance) == 0:
-            logger.warning(f'Turn {turn.turn_id} has a response with no passage provenances')
+            logger.warning('Turn %s has a response with no passage provenances', turn.turn_id)
             warning_count += 1
         elif len(response.passage_provenance) > 1000:
-            logger.warning(f'Turn {turn.turn_id} has a response with >1000 passages ({len(response.passage_provenance)})')
+            logger.warning('Turn %s has a response with >1000 passages (%d)', turn.turn_id, len(response.passage_provenance))
             warning_count += 1
 
         if len(response.ptkb_provenance) == 0:
-            logger.warning(f'No PTKB provenances listed for a response in turn {turn.turn_id}!')
+            logger.warning('No PTKB provenances listed for a response in turn %s!', turn.turn_id)
             warning_count += 1
             continue # no point in doing the next block 
 
@@ -162,7 +169,7 @@ def validate_turn(turn: Turn, ptkb_data: dict[str, Any], stub: Union[None, Passa
 
     return warning_count, service_errors
 
-def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) -> dict[str, List[Turn]]:
+def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) -> dict[str, List[Tuple[int, Turn]]]:
     """
     Given a run file, verify the number of turns.
 
@@ -171,7 +178,8 @@ def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) ->
         2. Checking that there are the correct number of turns for each topic
 
     To make subsequent topic-by-topic validation simpler, this will also pull out
-    the list of individual turns for each topic and return those. 
+    the list of individual turns for each topic and return those, as (turn number,
+    Turn) tuples so the turn IDs don't have to be parsed again.
     """
     
     # we already know the number of turns in topics_dict is correct after checking
@@ -182,7 +190,7 @@ def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) ->
         logger.error(f'The run contains {len(run.turns)} turns, but the test topics contain {EXPECTED_RUN_TURN_COUNT} turns')
         sys.exit(255)
 
-    run_topics_dict: dict[str, List[Turn]] = {}
+    run_topics_dict: dict[str, List[Tuple[int, Turn]]] = {}
     for turn in run.turns:
         # check if the turn ID looks valid
         try:
@@ -195,7 +203,7 @@ def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) ->
         if topic_id not in run_topics_dict:
             run_topics_dict[topic_id] = []
 
-        run_topics_dict[topic_id].append(turn)
+        run_topics_dict[topic_id].append((turn_id, turn))
 
     # check we have the expected number of topics from the run file
     if len(run_topics_dict) != EXPECTED_TOPIC_ENTRIES:
@@ -236,17 +244,32 @@ def validate_run(run: iKATRun, topics_dict: dict[str, dict[str, Any]], stub: Uni
 
     run_topics_dict = validate_all_turns(run, topics_dict)
 
+    # will be None if skip_passage_validation was used
+    passage_validity = None
+    if stub is not None:
+        try:
+            # check the passage IDs from every turn with the validation service up front,
+            # rather than making a separate gRPC call for each turn
+            passage_validity = validate_passages_bulk(stub, run.turns, timeout)
+        except grpc.RpcError as rpce:
+            logger.warning(f'A gRPC error occurred when validating passages (name={rpce.code().name}, message={rpce.details()})')
+            # always abort if a passage ID validation error occurs
+            logger.error('Validation service errors encountered')
+            sys.exit(255)
+
     for topic_id, topic_data in run_topics_dict.items():
-        for turn in topic_data:
-            topic_id, turn_id = turn.turn_id.split('_')
-            turn_id = int(turn_id)
+        max_turn_id = len(topics_dict[topic_id]['turns'])
 
-            max_turn_id = len(topics_dict[topic_id]['turns'])
+        for turn_id, turn in topic_data:
             if turn_id < 1 or turn_id > max_turn_id:
                 logger.error(f'Turn {turn.turn_id} has an invalid turn ID {turn_id}, expected range: 1-{max_turn_id}')
                 sys.exit(255)
 
-            _warnings, _service_errors = validate_turn(turn, topics_dict[topic_id]['ptkb'], stub, timeout)
+            try:
+                _warnings, _service_errors = validate_turn(turn, topics_dict[topic_id]['ptkb'], stub, timeout, passage_validity)
+            except ValidationFatal as e:
+                logger.error(str(e))
+                sys.exit(255)
             total_warnings += _warnings
             service_errors += _service_errors
             turns_validated += 1
@@ -275,6 +298,12 @@ def validate(run_file_path: str, fileroot: str, max_warnings: int, skip_validati
     fileHandler.setFormatter(formatter)
     logger.addHandler(fileHandler)
 
+    # protobuf uses its upb C extension by default, but falls back to a much slower
+    # pure Python implementation if that isn't available for the platform (or if
+    # PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=python is set)
+    if api_implementation.Type() == 'python':
+        logger.warning('Using the pure Python protobuf implementation, validation will be slow')
+
     # only instantiate the gRPC service client if skip_validation is False
     validator_stub = None if skip_validation else get_stub()
 
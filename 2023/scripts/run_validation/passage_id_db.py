@@ -1,5 +1,6 @@
 import argparse
 import csv
+import json
 import logging
 import os
 import sqlite3
@@ -27,6 +28,9 @@ class PassageIDDatabase:
     TABLE_NAME = 'passage_ids'
     COL_NAME = 'id'
 
+    # the IDs to validate are passed in as a JSON array and expanded by json_each
+    SQL_VALIDATE = f'SELECT {COL_NAME} FROM {TABLE_NAME} WHERE {COL_NAME} IN (SELECT value FROM json_each(?))'
+
     def __init__(self, path: str) -> None:
         self.path = path
         self._conn: Optional[sqlite3.Connection] = None
@@ -124,17 +128,17 @@ class PassageIDDatabase:
         if self._conn is None:
             raise Exception('Database connection has not been opened')
 
-        results = []
+        # look up all the IDs in a single query instead of one query per ID. The IDs
+        # are passed in as a JSON array and expanded by json_each, so there's no
+        # limit on the number of IDs like there would be with bound parameters.
+        # The service passes in the repeated field from its request, so it's
+        # converted to a list for json.dumps
         cur = self._conn.cursor()
-        for id in ids:
-            cur.execute(f'SELECT {PassageIDDatabase.COL_NAME} FROM {PassageIDDatabase.TABLE_NAME} \
-                    WHERE {PassageIDDatabase.COL_NAME} = ?', (id, ))
-            result = cur.fetchone()
-            results.append(False if result is None else True)
-            logger.debug(f'Validate {id} = {result is not None}')
-
+        cur.execute(PassageIDDatabase.SQL_VALIDATE, (json.dumps(list(ids)), ))
+        found = {row[0] for row in cur}
         cur.close()
-        return results
+
+        return [id in found for id in ids]
 
     def close(self) -> bool:
         """
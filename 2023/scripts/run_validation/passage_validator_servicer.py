@@ -1,4 +1,5 @@
 import argparse
+import os
 import sys
 from concurrent import futures
 
@@ -10,8 +11,13 @@ sys.path.append("./compiled_protobufs")
 from compiled_protobufs.passage_validator_pb2_grpc import add_PassageValidatorServicer_to_server
 
 
-def serve(db_path: str, expected_rows: int) -> None:
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+# default number of threads used to handle requests, the same as ThreadPoolExecutor's
+# own default. The threads share one SQLite connection, so adding more than this
+# mostly helps to overlap request handling for multiple clients
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+def serve(db_path: str, expected_rows: int, workers: int = DEFAULT_WORKERS) -> None:
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
     add_PassageValidatorServicer_to_server(PassageValidatorServicer(db_path, expected_rows), server)
 
     server.add_insecure_port("[::]:8000")
@@ -22,5 +28,6 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('db_path', type=str, help='SQLite database path', default='./files/ikat_2023_passages_hashes.sqlite3')
     parser.add_argument('expected_rows', type=int, nargs='?', default=IKAT_PASSAGE_COUNT, help='Expected number of rows in the database (0 to skip checking)')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help=f'Number of threads used to handle requests (default {DEFAULT_WORKERS})')
     args = parser.parse_args()
-    serve(args.db_path, args.expected_rows)
+    serve(args.db_path, args.expected_rows, args.workers)
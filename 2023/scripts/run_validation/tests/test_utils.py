@@ -1,13 +1,14 @@
 import pytest
 
 from compiled_protobufs.passage_validator_pb2 import PassageValidationRequest
-from compiled_protobufs.run_pb2 import PassageProvenance
-from utils import validate_passages
+from compiled_protobufs.run_pb2 import PassageProvenance, Turn
+import utils
+from utils import validate_passages, validate_passages_bulk
 from main import GRPC_DEFAULT_TIMEOUT, validate_turn, load_topic_data
 
 def build_request(ids):
     request = PassageValidationRequest()
-    request.passage_ids.MergeFrom(ids)
+    request.passage_ids.extend(ids)
     return request
 
 def get_invalid_indices(response):
@@ -84,3 +85,21 @@ def test_empty(grpc_stub_test):
     """
     response = grpc_stub_test.validate_passages(build_request([]))
     assert(len(get_invalid_indices(response)) == 0)
+
+def test_validate_passages_bulk(grpc_stub_test, sample_ids, monkeypatch):
+    """
+    Test that validate_passages_bulk checks the IDs from multiple turns across several requests.
+    """
+    # use small batches so the IDs are split over multiple requests
+    monkeypatch.setattr(utils, 'PASSAGE_VALIDATION_BATCH_SIZE', 7)
+
+    valid_ids = sample_ids[0:len(sample_ids):500]
+    invalid_ids = ['foo', 'bar', 'foobar']
+    turns = []
+    for ids in [valid_ids[:10], valid_ids[10:] + invalid_ids, valid_ids[:5]]:
+        turn = Turn()
+        turn.responses.add().passage_provenance.extend(PassageProvenance(id=id) for id in ids)
+        turns.append(turn)
+
+    passage_validity = validate_passages_bulk(grpc_stub_test, turns, GRPC_DEFAULT_TIMEOUT)
+    assert(passage_validity == {**{id: True for id in valid_ids}, **{id: False for id in invalid_ids}})
@@ -1,13 +1,27 @@
 import sys
 
 from logging import Logger
-from typing import Any, List
+from typing import Any, Iterable, List, Tuple
 
 sys.path.append('./compiled_protobufs')
 from passage_validator_pb2 import PassageValidationRequest
 from passage_validator_pb2_grpc import PassageValidatorStub
 from run_pb2 import Turn, PassageProvenance, PTKBProvenance, Response
 
+# the maximum number of passage IDs sent to the validation service in a single request.
+# This keeps each request well below gRPC's default 4MB message size limit
+PASSAGE_VALIDATION_BATCH_SIZE = 50000
+
+# the prefix all passage IDs in the collection start with
+PASSAGE_ID_PREFIX = 'clueweb22-'
+
+class ValidationFatal(Exception):
+    """
+    Raised by the check_* functions for problems that should abort the validation.
+
+    validate_run logs the message and exits, so the checks themselves don't have to.
+    """
+
 def check_response(response: Response, logger: Logger, previous_rank: int, turn_id: str) -> int:
     """
     Validate a Response within a Turn.
@@ -23,49 +37,62 @@ def check_response(response: Response, logger: Logger, previous_rank: int, turn_
 
     # the rank should be >= 1
     if response.rank == 0:
-        logger.warning(f"Response rank for turn {turn_id} is missing or equal to 0")
+        logger.warning("Response rank for turn %s is missing or equal to 0", turn_id)
         new_warnings += 1
 
     # rank values should increase with successive responses
     if response.rank <= previous_rank:
-        logger.warning(f"Current rank {response.rank} is less than or equal to previous rank {previous_rank} for turn {turn_id}. Provenance ranking may not be in descending order")
+        logger.warning("Current rank %d is less than or equal to previous rank %d for turn %s. Provenance ranking may not be in descending order", response.rank, previous_rank, turn_id)
         new_warnings += 1
 
     # the response text shouldn't be empty
     if len(response.text) == 0:
-        logger.warning(f"Response text for turn {turn_id} is missing")
+        logger.warning("Response text for turn %s is missing", turn_id)
         new_warnings += 1
     
     return new_warnings
 
-def check_passage_provenance(prev_score: float, provenance: PassageProvenance, logger: Logger, turn_id: str) -> int:
+def check_passage_provenances(passage_provenance: Iterable[PassageProvenance], logger: Logger, turn_id: str) -> Tuple[int, int]:
     """
-    Validate a PassageProvenance entry.
+    Validate the PassageProvenance entries of a Response.
 
-    This checks if the PassageProvenance:
+    This checks if each PassageProvenance:
      - has a score below that of the previous entry
      - has a 'clueweb22-' prefix on the passage ID
      - has a single colon in the passage ID
 
-    Return value is the number of warnings generated.
+    The entries are all checked in one loop rather than with a function call for
+    each of them, since a response can have up to 1000 of them.
+
+    Return value is a tuple of (number of warnings generated, number of entries marked as used).
     """
     new_warnings = 0
+    passages_used = 0
+    prev_score = 1e9
 
-    # the scores should decrease with each entry
-    if provenance.score > prev_score:
-        logger.warning(f'Provenance entry with ID {provenance.id} in turn {turn_id} has a greater score than the previous passage ({provenance.score} > {prev_score}. Ranking order for turn {turn_id} not correct')
-        new_warnings += 1
+    for provenance in passage_provenance:
+        passage_id = provenance.id
+        score = provenance.score
 
-    # check the passage ID seems sensible
-    if not provenance.id.startswith('clueweb22-'):
-        logger.warning(f'{provenance.id} does not have a "clueweb22-" prefix, may be invalid')
-        new_warnings += 1
+        # the scores should decrease with each entry
+        if score > prev_score:
+            logger.warning('Provenance entry with ID %s in turn %s has a greater score than the previous passage (%s > %s. Ranking order for turn %s not correct', passage_id, turn_id, score, prev_score, turn_id)
+            new_warnings += 1
 
-    if len(provenance.id.split(':')) != 2:
-        logger.warning(f'{provenance.id} seems to be formatted incorrectly (missing/extra colons?)')
-        new_warnings += 1
+        # check the passage ID seems sensible
+        if not passage_id.startswith(PASSAGE_ID_PREFIX):
+            logger.warning('%s does not have a "%s" prefix, may be invalid', passage_id, PASSAGE_ID_PREFIX)
+            new_warnings += 1
 
-    return new_warnings
+        # count doesn't create a list like split(':') would
+        if passage_id.count(':') != 1:
+            logger.warning('%s seems to be formatted incorrectly (missing/extra colons?)', passage_id)
+            new_warnings += 1
+
+        prev_score = score
+        passages_used += provenance.used
+
+    return new_warnings, passages_used
 
 def check_ptkb_provenance(ptkb_prov: PTKBProvenance, turn: Turn, ptkbs: dict[str, Any], prev_score: float, logger: Logger) -> int:
     """
@@ -77,28 +104,73 @@ def check_ptkb_provenance(ptkb_prov: PTKBProvenance, turn: Turn, ptkbs: dict[str
      - has PTKB text that matches the corresponding entry in the topics file
      - has a score that is greater than the previous entry
 
+    If any of the first three conditions isn't met, ValidationFatal is raised.
+
     Return value is the number of warnings generated.
     """
     new_warnings = 0
 
     if len(ptkb_prov.id) == 0:
-        logger.error(f'A PTKB provenance ID in turn {turn.turn_id} is empty')
-        sys.exit(255)
+        raise ValidationFatal(f'A PTKB provenance ID in turn {turn.turn_id} is empty')
 
-    if ptkb_prov.id not in ptkbs:
-        logger.error(f'PTKB provenance with ID {ptkb_prov.id} in turn {turn.turn_id} is invalid')
-        sys.exit(255)
+    # a single lookup covers both the ID and text checks
+    ptkb_text = ptkbs.get(ptkb_prov.id)
+    if ptkb_text is None:
+        raise ValidationFatal(f'PTKB provenance with ID {ptkb_prov.id} in turn {turn.turn_id} is invalid')
 
-    if ptkb_prov.text != ptkbs[ptkb_prov.id]:
-        logger.error(f'PTKB provenance with ID {ptkb_prov.id} in turn {turn.turn_id} has a text mismatch')
-        sys.exit(255)
+    if ptkb_prov.text != ptkb_text:
+        raise ValidationFatal(f'PTKB provenance with ID {ptkb_prov.id} in turn {turn.turn_id} has a text mismatch')
 
     if ptkb_prov.score > prev_score:
-        logger.warning(f'PTKB provenance with ID {ptkb_prov.id} in turn {turn.turn_id} has a score greater than the previous entry, ordering may be incorrect')
+        logger.warning('PTKB provenance with ID %s in turn %s has a score greater than the previous entry, ordering may be incorrect', ptkb_prov.id, turn.turn_id)
         new_warnings += 1
 
     return new_warnings
 
+def get_passage_ids(turns: Iterable[Turn]) -> List[str]:
+    """
+    Return the unique passage IDs referenced by the responses in a sequence of Turns.
+
+    The IDs are returned in the order they first appear.
+    """
+    # dict keys are used instead of a set so the warnings for invalid IDs are always logged in the same order
+    return list(dict.fromkeys(provenance.id for turn in turns for response in turn.responses for provenance in response.passage_provenance))
+
+def validate_passages_bulk(passage_validation_client: PassageValidatorStub, turns: Iterable[Turn], timeout: float) -> dict[str, bool]:
+    """
+    Validate the passage IDs from a sequence of Turns using the gRPC validation service.
+
+    Rather than making a call for each Turn, the unique passage IDs from all of them
+    are sent together, in requests of up to PASSAGE_VALIDATION_BATCH_SIZE IDs.
+
+    Return value is a dict mapping each passage ID to True (valid) or False (invalid).
+    """
+    passage_ids = get_passage_ids(turns)
+    passage_validity = {}
+
+    for i in range(0, len(passage_ids), PASSAGE_VALIDATION_BATCH_SIZE):
+        batch = passage_ids[i:i + PASSAGE_VALIDATION_BATCH_SIZE]
+        passage_validation_request = PassageValidationRequest()
+        passage_validation_request.passage_ids.extend(batch)
+        passage_validation_result = passage_validation_client.validate_passages(passage_validation_request, timeout=timeout)
+
+        for passage_id, passage_validation in zip(batch, passage_validation_result.passage_validations):
+            passage_validity[passage_id] = passage_validation.is_valid
+
+    return passage_validity
+
+def check_passages(passage_validity: dict[str, bool], logger: Logger, turn: Turn) -> int:
+    """
+    Check the passage IDs referenced in a Turn against the results from validate_passages_bulk.
+
+    Return value is the number of passage IDs found to be invalid.
+    """
+    invalid_ids = [passage_id for passage_id in get_passage_ids([turn]) if not passage_validity[passage_id]]
+    for passage_id in invalid_ids:
+        logger.warning("Provenance with ID %s does not exist in the passage collection", passage_id)
+
+    return len(invalid_ids)
+
 def validate_passages(passage_validation_client: PassageValidatorStub, logger: Logger, turn: Turn, timeout: float) -> int:
     """
     Validate passage IDs using the gRPC validation service.
@@ -109,22 +181,5 @@ def validate_passages(passage_validation_client: PassageValidatorStub, logger: L
 
     Return values is the number of passage IDs found to be invalid. 
     """
-    passage_validation_request = PassageValidationRequest()
-
-    # build a list of passage IDs, filtering out duplicates
-    passage_ids_set = set()
-    for response in turn.responses:
-        for provenance in response.passage_provenance:
-            passage_ids_set.add(provenance.id)
-    passage_ids: List[str] = list(passage_ids_set)
-
-    # call the validator service
-    passage_validation_request.passage_ids.MergeFrom(passage_ids)
-    passage_validation_result = passage_validation_client.validate_passages(passage_validation_request, timeout=timeout)
-
-    # check if any passage IDs failed to validate
-    invalid_indexes = [i for i, passage_validation in enumerate(passage_validation_result.passage_validations) if not passage_validation.is_valid]
-    for index in invalid_indexes:
-        logger.warning(f"Provenance with ID {passage_ids[index]} does not exist in the passage collection")
-
-    return len(invalid_indexes)
+    passage_validity = validate_passages_bulk(passage_validation_client, [turn], timeout)
+    return check_passages(passage_validity, logger, turn)
@@ -1,48 +1,118 @@
-from typing import List
+from typing import Any, Iterable, Iterator, List, Optional
 
-import spacy
+# pipeline components that aren't needed to split documents into sentences
+EXCLUDED_COMPONENTS = ["parser", "tagger", "ner", "attribute_ruler", "lemmatizer", "tok2vec"]
 
 
 class SpacyPassageChunker:
 
-    def __init__(self, max_len: int, stride: int, model: str = 'en_core_web_sm'):
+    def __init__(self, max_len: int, stride: int, model: str = 'en_core_web_sm', batch_size: int = 64, n_process: int = 1,
+                 max_chars: Optional[int] = 10000, sentencizer: bool = False):
         self.max_len = max_len
         self.stride = stride
+        # documents are truncated to this many characters before they're tokenized (the
+        # official passages were generated this way, so changing it changes the passages
+        # and their hashes). None disables the truncation
+        self.max_chars = max_chars
+        # used by tokenize_documents
+        self.batch_size = batch_size
+        self.n_process = n_process
         self.document_sentences = []
-        try:
-            self.model = spacy.load(model,
-                                    exclude=["parser", "tagger", "ner", "attribute_ruler", "lemmatizer", "tok2vec"])
-        except OSError:
-            print(f"Downloading spaCy model {model}")
-            spacy.cli.download(model)
-            print("Finished downloading model")
-            self.model = spacy.load(model,
-                                    exclude=["parser", "tagger", "ner", "attribute_ruler", "lemmatizer", "tok2vec"])
-        self.model.enable_pipe("senter")
+        # each chunker loads its own copy of the model rather than sharing one, because
+        # the pipeline is modified below and ikat_tools creates a new chunker to get a
+        # fresh model after segmenting a large number of documents
+        if sentencizer:
+            # split sentences with spaCy's rule-based sentencizer, which only looks at punctuation.
+            # This is much faster than the senter model but the passages will be different from
+            # the official ones. It only needs spaCy's default English tokenizer, so <model>
+            # isn't loaded (or downloaded) at all
+            self.model = self.load_sentencizer_model()
+        else:
+            self.model = self.load_model(model)
+            self.model.enable_pipe("senter")
         self.model.max_length = 1500000000  # for documents that are longer than the spacy character limit
 
     @staticmethod
     def download_spacy_model(model="en_core_web_sm"):
+        import spacy
+
         print(f"Downloading spaCy model {model}")
         spacy.cli.download(model)
         print("Finished downloading model")
 
     @staticmethod
     def load_model(model="en_core_web_sm"):
-        return spacy.load(model, exclude=["parser", "tagger", "ner", "attribute_ruler", "lemmatizer", "tok2vec"])
+        # spaCy is imported here rather than at the top of the module because it takes around
+        # half a second, and ikat_tools imports this module for commands that don't need it
+        import spacy
 
-    def tokenize_document(self, document_body: str) -> None:
+        # the model isn't downloaded automatically here: the chunker is created in several
+        # worker processes at once, which would all try to download it at the same time
+        try:
+            return spacy.load(model, exclude=EXCLUDED_COMPONENTS)
+        except OSError as ose:
+            raise RuntimeError(f"spaCy model {model} is not installed. Install it with requirements.txt, "
+                               f"or run SpacyPassageChunker.download_spacy_model('{model}') once") from ose
+
+    @staticmethod
+    def load_sentencizer_model(lang="en"):
+        import spacy
+
+        nlp = spacy.blank(lang)
+        nlp.add_pipe("sentencizer")
+        return nlp
+
+    def _prepare_document(self, document_body: str) -> str:
         document_body = document_body.strip()
-        spacy_document = self.model(document_body[:10000])
-        self.document_sentences = list(spacy_document.sents)
+        if self.max_chars is None:
+            return document_body
+        return document_body[:self.max_chars]
+
+    def tokenize_document(self, document_body: str) -> None:
+        spacy_document = self.model(self._prepare_document(document_body))
+        # keep the text of each sentence rather than the Span objects, which would keep the whole Doc alive
+        self.document_sentences = [s.text for s in spacy_document.sents]
+
+    def tokenize_documents(self, document_bodies: Iterable[Any], as_tuples: bool = False) -> Iterator[Any]:
+        """
+        Tokenize and chunk a sequence of documents, yielding the passages for each one in turn.
+
+        The documents go through spaCy in batches of self.batch_size using nlp.pipe, which has
+        less overhead than calling tokenize_document and chunk_document for each of them.
+
+        If as_tuples is True, document_bodies should contain (document body, context) tuples,
+        and (passages, context) tuples are yielded in place of just the passages, the same
+        as nlp.pipe(as_tuples=True). This keeps each document's passages together with
+        whatever the caller needs to store with them (e.g. the document ID).
+
+        If self.n_process is more than 1, spaCy starts that many processes to handle the
+        batches. This only pays off for large numbers of documents, since each process has
+        to load its own copy of the model, and it shouldn't be used when the chunker is
+        already running in one of several worker processes.
+        """
+        if as_tuples:
+            texts = ((self._prepare_document(document_body), context) for document_body, context in document_bodies)
+        else:
+            texts = ((self._prepare_document(document_body), None) for document_body in document_bodies)
+
+        results = self.model.pipe(texts, as_tuples=True, batch_size=self.batch_size, n_process=self.n_process)
+        for spacy_document, context in results:
+            passages = self.chunk_document([s.text for s in spacy_document.sents])
+            yield (passages, context) if as_tuples else passages
+
+    def chunk_document(self, sentences: Optional[List[str]] = None) -> List[str]:
+        return list(self.iter_chunks(sentences))
 
-    def chunk_document(self) -> List[str]:
-        sentences = self.document_sentences
-        segments = []
+    def iter_chunks(self, sentences: Optional[List[str]] = None) -> Iterator[str]:
+        """
+        Yield the passages from chunk_document one at a time instead of returning them in a list.
+        """
+        # default to the sentences from the last call to tokenize_document
+        if sentences is None:
+            sentences = self.document_sentences
 
         for i in range(0, len(sentences), self.stride):
-            segment = ' '.join([str(s) for s in sentences[i:i + self.max_len]])
-            segments.append(segment)
+            segment = ' '.join(sentences[i:i + self.max_len])
+            yield segment
             if i + self.max_len >= len(sentences):
                 break
-        return segments
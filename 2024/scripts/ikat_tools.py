@@ -2,25 +2,53 @@ import argparse
 import bz2
 import csv
 import hashlib
+import heapq
 import json
 import os
-import queue
 import subprocess
-from multiprocessing import Manager, Process, Queue
-from typing import IO, List, Tuple
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Queue, Value
+from typing import IO, Dict, Iterable, Iterator, List, Tuple
 
-import _csv
 import tqdm
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from spacy_passage_chunker import SpacyPassageChunker
 
 # max number of records to have queued while segmenting
 QUEUE_LIMIT = 10_000
+# number of records sent to the worker processes in each queue item
+LINE_BATCH_SIZE = 256
+# buffer size for the worker output files, to avoid making a write() call for every few records
+OUTPUT_BUFFER_SIZE = 1 << 20
 # total number of records in the collection
 RECORDS = 13_467_076
 # total number of passages that should result after segmenting with this script
 PASSAGES = 116_838_987
 
+# use orjson for (de)serializing records if it's available, it's several times faster than json
+if orjson is not None:
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+else:
+    json_loads = json.loads
+
+    def json_dumps(obj) -> bytes:
+        # match orjson's output, which is compact and doesn't escape non-ASCII characters
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+# number of passages hashed by each task submitted to the thread pool while verifying hashes
+HASH_BATCH_SIZE = 1_000
+# hashlib algorithms that can be used for passage hashes. The official hashes use MD5, the
+# others can be faster but only verify against hashes generated with the same algorithm
+HASH_ALGORITHMS = ('md5', 'blake2b')
+
 def open_file(filename: str) -> IO:
     """
     Open a file with/without bzip2 depending on file extension.
@@ -35,6 +63,7 @@ def write_passages_json(json_file: IO, passages: List[str], title: str, id: str,
     Write a set of passages to a JSONL file (one per line).
 
     The record format is compatible with pyserini/anserini JSONCollection.
+    The file must be opened in binary mode.
     """
     for i, passage in enumerate(passages):
         obj = {
@@ -42,126 +71,240 @@ def write_passages_json(json_file: IO, passages: List[str], title: str, id: str,
             'contents': passage,
             'url': url,
         }
-        json_file.write(json.dumps(obj) + '\n')
+        json_file.write(json_dumps(obj) + b'\n')
 
-def create_trecweb_entry(idx: str, url: str, title: str, body: str) -> str:
+def write_passages_trecweb(trecweb_file: IO, passages: List[str], title: str, id: str, url: str) -> None:
     """
-    Create and return a trecweb entry as a single string.
+    Write a set of a passages to a trecweb file.
+
+    Each passage is surrounded with <PASSAGE></PASSAGE> tags with an "id"
+    attribute taken from the index of the passage in the supplied list.
+    The entry is written piece by piece rather than being built up as a
+    single string first.
     """
-    return ''.join([
-        '<DOC>\n',
-        f'<DOCNO>{idx}</DOCNO>\n',
-        '<DOCHDR>\n</DOCHDR>\n',
-        '<HTML>\n',
-        f'<TITLE>{title}</TITLE>\n',
-        f'<URL>{url}</URL>\n',
-        '<BODY>\n',
-        body,
-        '</BODY>\n',
-        '</HTML>\n',
-        '</DOC>'
-    ])
+    trecweb_file.write(
+        '<DOC>\n'
+        f'<DOCNO>{id}</DOCNO>\n'
+        '<DOCHDR>\n</DOCHDR>\n'
+        '<HTML>\n'
+        f'<TITLE>{title}</TITLE>\n'
+        f'<URL>{url}</URL>\n'
+        '<BODY>\n'
+    )
+
+    for i, passage in enumerate(passages):
+        # passages are separated by newlines, but there's no newline between the last one and </BODY>
+        if i > 0:
+            trecweb_file.write('\n')
+        trecweb_file.write(f'<PASSAGE id={i}>\n{passage}\n</PASSAGE>')
 
-def add_passage_ids(passages: List[str]) -> str:
+    trecweb_file.write('</BODY>\n</HTML>\n</DOC>\n')
+
+def write_hashes(hash_file: IO, cwid: str, passages: List[str], hash_name: str = 'md5') -> None:
     """
-    Add trecweb tags to a list of passages.
+    Write a set of passage hashes to a .tsv file.
 
-    This just surrounds each passage with <PASSAGE></PASSAGE> tags
-    and adds an "id" attribute taken from the index of the passage
-    in the supplied list. 
+    Each line has format:
+        ClueWeb22-ID<tab>passage ID<tab>passage hash (MD5 by default)
 
-    Returns the full set of tagged passages as a single string.
+    Lines end with \\r\\n, matching the files previously written with csv.writer.
     """
-    passage_splits = []
+    hash_file.write(''.join(f'{cwid}\t{i}\t{passage_hash}\r\n'
+                            for i, passage_hash in enumerate(hash_passages(passages, hash_name))))
 
-    for idx, passage in enumerate(passages):
-        passage_splits.append('<PASSAGE id={}>'.format(idx))
-        passage_splits.append(passage)
-        passage_splits.append('</PASSAGE>')
+def hash_passages(passages: List[str], hash_name: str = 'md5') -> List[str]:
+    """
+    Return the hashes of a list of passages using the hashlib algorithm <hash_name>.
 
-    return '\n'.join(passage_splits)
+    hashlib releases the GIL while hashing larger inputs, so batches of
+    passages can be hashed in parallel from a thread pool.
+    """
+    hash_func = getattr(hashlib, hash_name)
+    return [hash_func(p.encode('utf-8')).hexdigest() for p in passages]
 
-def write_passages_trecweb(trecweb_file: IO, passages: List[str], title: str, id: str, url: str) -> None:
+def batched(iterable: Iterable, batch_size: int) -> Iterator[List]:
     """
-    Write a set of a passages to a trecweb file.
+    Split an iterable into lists of up to <batch_size> items.
     """
-    passage_splits = add_passage_ids(passages)
-    trecweb_entry = create_trecweb_entry(
-        idx=id,
-        url=url,
-        title=title,
-        body=passage_splits
-    )
-    trecweb_file.write(trecweb_entry + '\n')
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
 
-def write_hashes(hash_file: '_csv._writer', cwid: str, passages: List[str]) -> None:
+    if len(batch) > 0:
+        yield batch
+
+def read_passages(jsonl_file: IO) -> Iterator[Tuple[str, str]]:
     """
-    Write a set of passage hashes to a .tsv file.
+    Read passages from a JSONL file.
 
-    Each line has format:
-        ClueWeb22-ID<tab>passage ID<tab>passage MD5
+    Yields tuples of (passage ID, passage contents).
+    """
+    for line in jsonl_file:
+        data = json_loads(line)
+        yield data['id'], data['contents']
+
+def check_sorted(rows: Iterator[Tuple], source: str) -> Iterator[Tuple]:
+    """
+    Pass through a sequence of rows, checking they're sorted by their first element.
+    """
+    previous_key = None
+    for row in rows:
+        if previous_key is not None and row[0] < previous_key:
+            raise Exception(f'{source} is not sorted by passage ID, found {row[0]} after {previous_key}')
+        previous_key = row[0]
+        yield row
+
+def read_sorted_hashes(filename: str) -> Iterator[Tuple[Tuple[str, int], str]]:
     """
-    for i, p in enumerate(passages):
-        md5 = hashlib.md5()
-        md5.update(p.encode('utf-8'))
-        hash_file.writerow([cwid, i, md5.hexdigest()])
+    Read the rows of a sorted .tsv hash file.
 
-def ikat_segmenter_worker(worker_id: int, line_queue: Queue, gen_trecweb: bool, output_path: str, max_len: int, stride: int) -> None:
+    Yields tuples of ((ClueWeb22-ID, passage number), passage hash).
+    """
+    with open(filename, 'r') as f:
+        for clueweb_id, passage_num, passage_hash in csv.reader(f, delimiter='\t'):
+            yield (clueweb_id, int(passage_num)), passage_hash
+
+def read_sorted_passages(filename: str) -> Iterator[Tuple[Tuple[str, int], str, str, str]]:
+    """
+    Read the passages of a sorted JSONL file.
+
+    Yields tuples of ((ClueWeb22-ID, passage number), passage ID, passage contents, filename).
+    """
+    with open(filename, 'rb') as f:
+        for passage_id, contents in read_passages(f):
+            clueweb_id, passage_num = passage_id.rsplit(':', 1)
+            yield (clueweb_id, int(passage_num)), passage_id, contents, os.path.basename(filename)
+
+def lookup_passage_hashes(collection_path: str, collection_files: List[str], existing_hashes: Dict[str, str]) -> Iterator[Tuple[str, str, str, str]]:
+    """
+    Match up passages with their hashes using a dict of all the existing hashes.
+
+    Yields tuples of (collection file, passage ID, passage contents, existing hash).
+    """
+    for collection_file in collection_files:
+        with open(os.path.join(collection_path, collection_file), 'rb') as f:
+            for passage_id, contents in read_passages(f):
+                assert(passage_id in existing_hashes)
+                yield collection_file, passage_id, contents, existing_hashes[passage_id]
+
+def merge_passage_hashes(hashes_path: str, hash_files: List[str], collection_path: str, collection_files: List[str]) -> Iterator[Tuple[str, str, str, str]]:
+    """
+    Match up passages with their hashes by merging sorted hash and collection files.
+
+    The rows in each file, including the .jsonl collection files, must be sorted by
+    ClueWeb22-ID and then passage number, e.g. with "LC_ALL=C sort -t$'\\t' -k1,1 -k2,2n"
+    for the .tsv files. An exception is raised if a file turns out not to be sorted. Only the
+    current row of each file is held in memory, rather than all of the existing hashes.
+
+    Yields tuples of (collection file, passage ID, passage contents, existing hash).
+    """
+    hashes = heapq.merge(*[check_sorted(read_sorted_hashes(os.path.join(hashes_path, f)), f) for f in hash_files])
+    passages = heapq.merge(*[check_sorted(read_sorted_passages(os.path.join(collection_path, f)), f) for f in collection_files])
+
+    hash_key, existing_hash = next(hashes, (None, None))
+    for passage_key, passage_id, contents, collection_file in passages:
+        # skip any hashes for passages that aren't in the collection
+        while hash_key is not None and hash_key < passage_key:
+            hash_key, existing_hash = next(hashes, (None, None))
+
+        assert(hash_key == passage_key)
+        yield collection_file, passage_id, contents, existing_hash
+
+def verify_passage_hashes(passages: Iterator[Tuple[str, str, str, str]], hash_name: str, threads: int, error_file: IO, pbar: tqdm.tqdm) -> int:
+    """
+    Compute fresh hashes for a sequence of passages and compare them to the existing ones.
+
+    <passages> should yield tuples of (collection file, passage ID, passage contents, existing hash).
+    Passages are hashed in batches on a thread pool, with a bounded number of batches in flight
+    so the collection isn't read into memory faster than it can be hashed.
+
+    Returns the number of mismatched hashes.
+    """
+    def check_batch(batch: List[Tuple[str, str, str, str]], computed_hashes: List[str]) -> int:
+        batch_errors = 0
+        for (collection_file, passage_id, _, existing_hash), computed_hash in zip(batch, computed_hashes):
+            if computed_hash != existing_hash:
+                print(f'> ERROR: hash mismatch in {collection_file} on passage {passage_id}, computed hash {computed_hash}, existing hash {existing_hash}')
+                batch_errors += 1
+                error_file.write(f'{collection_file},{passage_id},{computed_hash},{existing_hash}\n')
+
+        pbar.update(len(batch))
+        return batch_errors
+
+    errors = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for batch in batched(passages, HASH_BATCH_SIZE):
+            pending.append((batch, executor.submit(hash_passages, [contents for _, _, contents, _ in batch], hash_name)))
+            if len(pending) >= 2 * threads:
+                batch, future = pending.popleft()
+                errors += check_batch(batch, future.result())
+
+        while len(pending) > 0:
+            batch, future = pending.popleft()
+            errors += check_batch(batch, future.result())
+
+    return errors
+
+def ikat_segmenter_worker(worker_id: int, line_queue: Queue, gen_trecweb: bool, output_path: str, max_len: int, stride: int, hash_name: str) -> None:
     """
     Method executed by worker processes during segmentation.
 
     It sets up output files for the given <worker_id>, then reads records from
-    the queue until none remain. Each record is segmented into passages using
+    the queue until it receives a None sentinel. Each record is segmented into passages using
     spaCy, then written to JSONL and possibly trecweb files if selected. 
 
-    Additionally a file containing MD5 hashes of each passage is created. 
+    Additionally a file containing hashes of each passage is created. 
     """
     chunker = SpacyPassageChunker(max_len=max_len, stride=stride)
     count = 0
 
-    output_json = open(os.path.join(output_path, f'worker_{worker_id:02d}.jsonl'), 'w', encoding='utf-8')
-    output_trecweb = open(os.path.join(output_path, f'worker_{worker_id:02d}.trecweb'), 'w', encoding='utf-8') if gen_trecweb else None
-    output_hashes = open(os.path.join(output_path, f'worker_{worker_id:02d}_hashes.tsv'), 'w')
-    hash_writer = csv.writer(output_hashes, delimiter='\t')
+    output_json = open(os.path.join(output_path, f'worker_{worker_id:02d}.jsonl'), 'wb', buffering=OUTPUT_BUFFER_SIZE)
+    output_trecweb = open(os.path.join(output_path, f'worker_{worker_id:02d}.trecweb'), 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) if gen_trecweb else None
+    output_hashes = open(os.path.join(output_path, f'worker_{worker_id:02d}_hashes.tsv'), 'w', buffering=OUTPUT_BUFFER_SIZE)
 
     while True:
-        try:
-            # the main process reads lines from the input files and adds them
-            # to this queue. if we fail to retrieve a new line from the queue
-            # then it indicates the input files are exhausted and this process
-            # can exit
-            line = line_queue.get(timeout=2.0)
-        except queue.Empty:
-            print(f'Worker {worker_id} found empty queue, exiting')
+        # the reader processes read lines from the input files and add them
+        # to this queue in batches. once they have all finished the main
+        # process adds a None for each worker to indicate the input files
+        # are exhausted and this process can exit
+        lines = line_queue.get()
+        if lines is None:
+            print(f'Worker {worker_id} finished, exiting')
             break
 
-        d = json.loads(line.strip())
-        # titles seem to be the first line of the Clean-Text field
-        title = d['Clean-Text'].split('\n')[0]
-        # URLs have a trailing newline to remove
-        url = d['URL'].strip()
-        id = d['ClueWeb22-ID']
-        
-        # run the text through spaCy after removing newline chars
-        doc_text = d['Clean-Text'].replace('\r', ' ').replace('\n', ' ')
-        chunker.tokenize_document(doc_text)
-        passages = chunker.chunk_document()
-
-        # write outputs in one or both formats, plus passage hashes
-        write_passages_json(output_json, passages, title, id, url)
-        
-        if output_trecweb is not None:
-            write_passages_trecweb(output_trecweb, passages, title, id, url)
-
-        write_hashes(hash_writer, id, passages)
-
-        count += 1
-        if count % 10_000 == 0:
+        records = (json_loads(line) for line in lines)
+        # run the text through spaCy after removing newline chars. The whole batch
+        # is passed to the chunker at once so spaCy can process it with nlp.pipe,
+        # with each record carried through alongside its text
+        doc_texts = ((d['Clean-Text'].replace('\r', ' ').replace('\n', ' '), d) for d in records)
+
+        for passages, d in chunker.tokenize_documents(doc_texts, as_tuples=True):
+            # titles seem to be the first line of the Clean-Text field
+            title = d['Clean-Text'].split('\n')[0]
+            # URLs have a trailing newline to remove
+            url = d['URL'].strip()
+            id = d['ClueWeb22-ID']
+
+            # write outputs in one or both formats, plus passage hashes
+            write_passages_json(output_json, passages, title, id, url)
+
+            if output_trecweb is not None:
+                write_passages_trecweb(output_trecweb, passages, title, id, url)
+
+            write_hashes(output_hashes, id, passages, hash_name)
+
+        count += len(lines)
+        if count >= 10_000:
             # Spacy models have associated data which can seemingly grow indefinitely as
             # new data is fed through it. Reloading the model periodically is the recommended
             # way to avoid this causing OOM conditions:
             # https://github.com/explosion/spaCy/discussions/10015
             chunker = SpacyPassageChunker(max_len, stride)
+            count = 0
 
     output_hashes.close()
     if output_json is not None:
@@ -169,18 +312,45 @@ def ikat_segmenter_worker(worker_id: int, line_queue: Queue, gen_trecweb: bool,
     if output_trecweb is not None:
         output_trecweb.close()
 
-def get_next_line(handles: List[IO]) -> Tuple[str, int]:
+def read_line_batches(handles: Iterable[IO], batch_size: int) -> Iterator[List[str]]:
+    """
+    Read lines from a set of file handles in batches of up to <batch_size> lines.
+
+    The handles are read one after the other, and each is closed once
+    it's exhausted. Empty lines are skipped.
+
+    Lines are passed on with their trailing newline rather than stripped, since
+    the JSON parser ignores it and stripping would copy every line.
     """
-    Read the first available line from a set of file handles.
+    batch = []
+    for h in handles:
+        for line in h:
+            if line.isspace():
+                continue
+
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        h.close()
 
-    Returns a tuple of (line, index of source file handle)
+    if len(batch) > 0:
+        yield batch
+
+def ikat_reader(input_files: List[str], line_queue: Queue, line_count: Value) -> None:
     """
-    for i, h in enumerate(handles):
-        line = h.readline()
-        if len(line) > 0:
-            return line.strip(), i
+    Method executed by reader processes during segmentation.
 
-    return "", -1
+    It reads the records from each of <input_files> in turn and adds them to
+    the queue in batches, keeping a running total of records in <line_count>.
+    Decompressing .bz2 files is single-threaded, so multiple readers are used
+    to keep the workers supplied with records.
+    """
+    file_handles = (open_file(f) for f in input_files)
+    for batch in read_line_batches(file_handles, LINE_BATCH_SIZE):
+        line_queue.put(batch)
+        with line_count.get_lock():
+            line_count.value += len(batch)
 
 def ikat_segmenter(args):
     """
@@ -206,53 +376,48 @@ def ikat_segmenter(args):
         raise Exception(f'No input files found in {args.input}')
 
     print(f'Found {len(input_files)} data files in {args.input}')
-    
-    file_handles = [open_file(f) for f in input_files]
-    # a multiprocess Queue object used to send data to the worker processes
-    line_queue = Manager().Queue(QUEUE_LIMIT)
-
-    # fill the queue up to the limit so the workers have initial
-    # content to get started with 
-    for i in range(QUEUE_LIMIT):
-        line, _ = get_next_line(file_handles)
-        if len(line) == 0:
-            break
 
-        line_queue.put(line)
+    # check the spaCy model is installed before starting the workers, so if it's
+    # missing that's reported once here instead of by each of the workers
+    SpacyPassageChunker.load_model()
+    
+    # a multiprocess Queue object used to send batches of lines from the reader
+    # processes to the worker processes
+    line_queue = Queue(QUEUE_LIMIT // LINE_BATCH_SIZE)
+    # total number of records added to the queue by the readers
+    line_count = Value('q', 0)
+
+    readers = []
+    # create and start the reader processes, splitting the input files between them
+    for i in range(min(args.num_readers, len(input_files))):
+        p = Process(target=ikat_reader, args=(input_files[i::args.num_readers], line_queue, line_count))
+        p.start()
+        readers.append(p)
 
     workers = []
     # create and start the worker processes
     for i in range(args.num_workers):
-        p = Process(target=ikat_segmenter_worker, args=(i, line_queue, args.trecweb, args.output, args.max_len, args.stride))
+        p = Process(target=ikat_segmenter_worker, args=(i, line_queue, args.trecweb, args.output, args.max_len, args.stride, args.hash))
         p.start()
         workers.append(p)
 
     with tqdm.tqdm(total=RECORDS) as pbar:
-        pbar.update(line_queue.qsize())
+        while any(r.is_alive() for r in readers):
+            time.sleep(1.0)
+            pbar.update(line_count.value - pbar.n)
 
-        while True:
-            line, from_handle = get_next_line(file_handles)
-            if len(line) == 0:
-                break
+        pbar.update(line_count.value - pbar.n)
 
-            # <from_handle> indicates the index in file_handles that
-            # <line> came from. If this is > 0 it indicates the previous
-            # handle(s) are exhausted and can be closed + removed from the
-            # list for future iterations
-            if from_handle > 0:
-                for i in range(from_handle):
-                    file_handles[i].close()
-                file_handles = file_handles[from_handle:]
+    for r in readers:
+        r.join()
 
-            line_queue.put(line)
-            pbar.update(1)
+    # tell each worker there are no more records to process
+    for w in workers:
+        line_queue.put(None)
 
     for w in workers:
         w.join()
 
-    for h in file_handles:
-        h.close()
-
 
 def ikat_generate_index(args):
     """
@@ -283,8 +448,6 @@ def ikat_verify_hashes(args):
     if not os.path.exists(args.collection):
         raise Exception(f'Collection directory {args.collection} does not exist')
 
-    existing_hashes = {}
-
     hash_files = [f for f in os.listdir(args.hashes) if f.endswith('.tsv')]
     collection_files = [f for f in os.listdir(args.collection) if f.endswith('.jsonl')]
 
@@ -296,42 +459,27 @@ def ikat_verify_hashes(args):
 
     print(f'> Will verify hashes from {len(hash_files)} .tsv files in {len(collection_files)} .jsonl files')
 
-    # read all the hashes from the .tsv file(s)
-    with tqdm.tqdm(desc='Reading hashes', total=PASSAGES) as pbar:
-        for i, hash_file in enumerate(hash_files):
-            reader = csv.reader(open(os.path.join(args.hashes, hash_file), 'r'), delimiter='\t')
-            for row in reader:
-                clueweb_id, passage_id, passage_hash = row
-                existing_hashes[f'{clueweb_id}:{passage_id}'] = passage_hash
-                pbar.update(1)
+    if args.sorted:
+        # stream through the sorted hash and collection files together
+        passages = merge_passage_hashes(args.hashes, hash_files, args.collection, collection_files)
+    else:
+        existing_hashes = {}
+
+        # read all the hashes from the .tsv file(s)
+        with tqdm.tqdm(desc='Reading hashes', total=PASSAGES) as pbar:
+            for i, hash_file in enumerate(hash_files):
+                reader = csv.reader(open(os.path.join(args.hashes, hash_file), 'r'), delimiter='\t')
+                for row in reader:
+                    clueweb_id, passage_id, passage_hash = row
+                    existing_hashes[f'{clueweb_id}:{passage_id}'] = passage_hash
+                    pbar.update(1)
+
+        passages = lookup_passage_hashes(args.collection, collection_files, existing_hashes)
 
-    errors = 0
     # now scan through all the JSONL files, compute fresh hashes and compare to the existing ones
     print(f'> Verifying hashes in {len(args.collection)} files')
     with tqdm.tqdm(desc='Verifying hashes', total=PASSAGES) as pbar, open(args.errors, 'w') as error_file:
-        for collection_file in collection_files:
-            with open(os.path.join(args.collection, collection_file), 'r', encoding='utf-8') as f:
-                while True:
-                    line = f.readline()
-                    if len(line) == 0:
-                        break
-
-                    data = json.loads(line.strip())
-
-                    passage_id = data['id']
-                    assert(passage_id in existing_hashes)
-                    passage_content = data['contents']
-                    pmd5 = hashlib.md5()
-                    pmd5.update(passage_content.encode('utf-8'))
-                    computed_hash = pmd5.hexdigest()
-                    existing_hash = existing_hashes[passage_id]
-
-                    if computed_hash != existing_hash:
-                        print(f'> ERROR: hash mismatch in {collection_file} on passage {passage_id}, computed hash {computed_hash}, existing hash {existing_hash}')
-                        errors += 1
-                        error_file.write(f'{collection_file},{passage_id},{computed_hash},{existing_hash}\n')
-
-                    pbar.update(1)
+        errors = verify_passage_hashes(passages, args.hash, args.threads, error_file, pbar)
 
     print(f'Hash verification finished with {errors} errors')
 
@@ -344,8 +492,10 @@ if __name__ == "__main__":
     segment_parser.add_argument('-t', '--trecweb', help='Generate trecweb files containing passages', action='store_true')
     segment_parser.add_argument('-o', '--output', help='Path to save output files', required=True, type=str)
     segment_parser.add_argument('-w', '--num_workers', help='Number of parallel workers to use', default=8, type=int)
+    segment_parser.add_argument('-r', '--num_readers', help='Number of parallel processes to use for reading the input files', default=4, type=int)
     segment_parser.add_argument('-m', '--max_len', help='Max length parameter for SpacyPassageChunker', default=10, type=int)
     segment_parser.add_argument('-s', '--stride', help='Stride parameter for SpacyPassageChunker', default=5, type=int)
+    segment_parser.add_argument('-a', '--hash', help='Algorithm used for passage hashes (the official hashes use md5)', default='md5', choices=HASH_ALGORITHMS)
     segment_parser.set_defaults(func=ikat_segmenter)
 
     create_index_parser = subparsers.add_parser('create_index', help='Generate pyserini index from JSONL passage data')
@@ -358,6 +508,9 @@ if __name__ == "__main__":
     verify_parser.add_argument('-H', '--hashes', help='Path to directory containing passage hashes in .tsv file(s)', required=True, type=str)
     verify_parser.add_argument('-c', '--collection', help='Path to directory containing segmented collection in .jsonl file(s)', required=True, type=str)
     verify_parser.add_argument('-e', '--errors', help='Filename to save errors found during verification', required=True, type=str)
+    verify_parser.add_argument('-t', '--threads', help='Number of threads to use for hashing passages', default=8, type=int)
+    verify_parser.add_argument('-s', '--sorted', help='Verify by merging hash and collection files that are sorted by passage ID, instead of loading all the hashes into memory. Both the .tsv and the .jsonl files must be sorted by ClueWeb22-ID and then passage number, verification stops with an error otherwise', action='store_true')
+    verify_parser.add_argument('-a', '--hash', help='Algorithm the hashes were generated with', default='md5', choices=HASH_ALGORITHMS)
     verify_parser.set_defaults(func=ikat_verify_hashes)
 
     args = parser.parse_args()
@@ -1,8 +1,6 @@
 import os
 import sys
-import csv
 import logging
-import pathlib
 from types import SimpleNamespace
 from concurrent import futures
 
@@ -13,9 +11,12 @@ test_root = os.path.dirname(__file__)
 sys.path.append(os.path.join(test_root, 'compiled_protobufs'))
 
 from passage_validator import PassageValidator as PassageValidatorServicer
-from passage_validator_pb2_grpc import add_PassageValidatorServicer_to_server
-from passage_id_db import PassageIDDatabase, IKAT_PASSAGE_COUNT
-from main import load_run_file, get_stub, GRPC_DEFAULT_TIMEOUT
+from passage_validator_servicer import DEFAULT_WORKERS
+from passage_validator_pb2_grpc import PassageValidatorStub, add_PassageValidatorServicer_to_server
+from passage_id_array import PassageIDArray
+from run_pb2 import Turn
+from passage_id_db import PassageIDDatabase, IKAT_PASSAGE_COUNT, read_passage_ids
+from main import load_run_file, load_topic_data, EXPECTED_RUN_TURN_COUNT, GRPC_DEFAULT_TIMEOUT
 
 # this file just contains the first 10k lines of the full hash file
 SAMPLE_HASHES_PATH           = os.path.join(test_root, 'tests', 'data', 'sample_hashes.tsv')
@@ -36,45 +37,67 @@ RUN_FILE_PATH_INVALID_SCORES = os.path.join(test_root, 'tests', 'data', 'sample_
 RUN_FILE_PATH_INVALID_PTKB   = os.path.join(test_root, 'tests', 'data', 'sample_run_missing_ptkb_fields.json')
 RUN_FILE_PATH_RENAMED_FIELDS = os.path.join(test_root, 'tests', 'data', 'sample_run_renamed_fields.json')
 
-@pytest.fixture
-def sample_database(tmp_path: pathlib.PurePath):
+# the session-scoped stubs share one channel each for all the tests, kept alive
+# with pings so the connection isn't dropped while other tests are running
+GRPC_TEST_CHANNEL_OPTIONS    = [
+    ('grpc.keepalive_time_ms', 60000),
+    ('grpc.keepalive_timeout_ms', 30000),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.enable_retries', 1),
+]
+
+def session_stub(port: int = 8000):
+    # like main.get_stub, but also returns the channel so it can be closed
+    channel = grpc.insecure_channel(f'localhost:{port}', options=GRPC_TEST_CHANNEL_OPTIONS)
+    return channel, PassageValidatorStub(channel)
+
+# fixtures that are expensive to set up and aren't modified by any tests are
+# session-scoped, so they're only created once per test run
+
+@pytest.fixture(scope='session')
+def sample_database(tmp_path_factory: pytest.TempPathFactory):
     # create a temporary SQLite database from the contents of sample_hashes.tsv
-    hdb = PassageIDDatabase(str(tmp_path / 'temp.sqlite3'))
+    hdb = PassageIDDatabase(str(tmp_path_factory.mktemp('sample_database') / 'temp.sqlite3'))
     hdb.open()
-    hdb.populate(SAMPLE_HASHES_PATH, 5000, 10000)
+    # insert all the rows in a single transaction
+    hdb.populate(SAMPLE_HASHES_PATH, SAMPLE_DB_COUNT, SAMPLE_DB_COUNT)
     yield hdb
     hdb.close()
 
-@pytest.fixture
+@pytest.fixture(scope='session')
+def sample_array(tmp_path_factory: pytest.TempPathFactory):
+    # create a temporary passage ID array from the contents of sample_hashes.tsv
+    pia = PassageIDArray(str(tmp_path_factory.mktemp('sample_array') / ('temp' + PassageIDArray.FILE_EXTENSION)))
+    pia.populate(SAMPLE_HASHES_PATH, 10000)
+    yield pia
+    pia.close()
+
+@pytest.fixture(scope='session')
 def sample_ids():
     # return a list of the valid IDs from sample_hashes.tsv
-    ids = []
-    with open(SAMPLE_HASHES_PATH, 'r') as f:
-        rdr = csv.reader(f, delimiter='\t')
-        ids = [f'{line[0]}:{line[1]}' for line in rdr]
-    yield ids
+    yield list(read_passage_ids(SAMPLE_HASHES_PATH))
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def topic_data_file():
     yield TOPIC_DATA_FILE
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def baseline_run_file():
     yield BASELINE_RUN_FILE
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def run_file_path_no_ptkb():
     yield RUN_FILE_PATH_NO_PTKB
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def run_file_path_invalid_scores():
     yield RUN_FILE_PATH_INVALID_SCORES
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def run_file_path_missing_ptkb_fields():
     yield RUN_FILE_PATH_INVALID_PTKB
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def run_file_path_renamed_fields():
     yield RUN_FILE_PATH_RENAMED_FIELDS
 
@@ -89,9 +112,29 @@ def default_validate_args():
     )
 
 @pytest.fixture
-def sample_turn(baseline_run_file: str):
+def local_validate_args(default_validate_args):
+    # validate passage IDs against the full database directly instead of through the service
+    default_validate_args.local_db_path = FULL_DB_PATH
+    yield default_validate_args
+
+@pytest.fixture(scope='session')
+def topic_data(topic_data_file: str):
+    # parsed once, tests must not modify this
+    yield load_topic_data(topic_data_file)
+
+@pytest.fixture(scope='session')
+def baseline_run(baseline_run_file: str):
+    # parsed once, tests must not modify this (copy it with CopyFrom if needed)
     run = load_run_file(baseline_run_file)
-    turn = run.turns[0]
+    # checked here once instead of in every test that uses the run
+    assert len(run.turns) == EXPECTED_RUN_TURN_COUNT
+    yield run
+
+@pytest.fixture
+def sample_turn(baseline_run):
+    # a copy, because some tests modify the turn
+    turn = Turn()
+    turn.CopyFrom(baseline_run.turns[0])
     yield turn
 
 @pytest.fixture
@@ -99,64 +142,76 @@ def test_logger(scope='module'):
     logger = logging.Logger('test_logger')
     yield logger
 
-@pytest.fixture(scope='module')
+@pytest.fixture(scope='session')
 def servicer_params_full():
     yield (FULL_DB_PATH, IKAT_PASSAGE_COUNT)
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def servicer_params_test():
     yield (SAMPLE_DB_PATH, SAMPLE_DB_COUNT)
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def grpc_stub_test(grpc_server_test):
-    yield get_stub(port=8099)
+    _, port = grpc_server_test
+    channel, stub = session_stub(port)
+    yield stub
+    channel.close()
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def grpc_stub_test_invalid(grpc_server_test_invalid):
-    yield get_stub()
+    channel, stub = session_stub()
+    yield stub
+    channel.close()
 
-@pytest.fixture(scope='module')
+@pytest.fixture(scope='session')
 def grpc_stub_full(grpc_server_full):
-    yield get_stub()
+    channel, stub = session_stub()
+    yield stub
+    channel.close()
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def grpc_server_test(servicer_params_test):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=DEFAULT_WORKERS))
     add_PassageValidatorServicer_to_server(PassageValidatorServicer(*servicer_params_test), server)
 
-    server.add_insecure_port("[::]:8099")
+    # port 0 lets the OS pick a free port, the fixture yields the (server, port) pair
+    port = server.add_insecure_port("[::]:0")
     server.start()
-    yield server
+    yield server, port
 
     server.stop(None)
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def grpc_server_test_invalid(servicer_params_test):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=DEFAULT_WORKERS))
     add_PassageValidatorServicer_to_server(PassageValidatorServicer(*servicer_params_test), server)
 
-    server.add_insecure_port("[::]:8999")
+    port = server.add_insecure_port("[::]:0")
     server.start()
-    yield server
+    yield server, port
 
     server.stop(None)
 
 @pytest.fixture
-def grpc_server_full_alt(servicer_params_full):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    add_PassageValidatorServicer_to_server(PassageValidatorServicer(*servicer_params_full), server)
+def grpc_server_stopped(servicer_params_test):
+    # a server that has already been shut down, for tests of what happens when
+    # the service isn't available. This is created per test because it can't be
+    # reused, but it only needs the sample database
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
+    add_PassageValidatorServicer_to_server(PassageValidatorServicer(*servicer_params_test), server)
 
-    server.add_insecure_port("[::]:8199")
+    port = server.add_insecure_port("[::]:0")
     server.start()
-    yield server
-
-    server.stop(None)
+    server.stop(None).wait()
+    yield server, port
 
-@pytest.fixture(scope='module')
+@pytest.fixture(scope='session')
 def grpc_server_full(servicer_params_full):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=DEFAULT_WORKERS))
     add_PassageValidatorServicer_to_server(PassageValidatorServicer(*servicer_params_full), server)
 
+    # this has to use the default port because main.validate connects to it. Tests
+    # using this are in the "grpc_full" xdist group so only one worker binds the port
     server.add_insecure_port("[::]:8000")
     server.start()
     yield server
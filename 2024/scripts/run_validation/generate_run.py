@@ -1,10 +1,7 @@
 import argparse
-import json
 from pathlib import PurePath
 
-from google.protobuf.json_format import Parse, ParseDict
-
-from compiled_protobufs.run_pb2 import iKATRun
+from main import load_run_file
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser(description='TREC 2022 CAsT run generator',
@@ -12,10 +9,8 @@ if __name__ == "__main__":
     ap.add_argument('path_to_run_file')
     args = ap.parse_args()
 
-    # validate structure
-    with open(args.path_to_run_file) as run_file:
-        run = json.load(run_file)
-        run = ParseDict(run, iKATRun())
+    # validate structure (using orjson to parse the file if it's available)
+    run = load_run_file(args.path_to_run_file)
 
     run_file_name = PurePath(args.path_to_run_file).name
 
@@ -1,19 +1,41 @@
 import argparse
-import json
+import functools
 import logging
+import math
 import os
 import sys
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import PurePath
-from typing import Any
+from typing import IO, Any, Iterator
 
 import grpc
+from google.protobuf.internal import api_implementation
 from google.protobuf.json_format import ParseDict
 
-from utils import check_passage_provenance, check_ptkb_provenance, check_response, validate_passages
+# orjson parses large run files much faster than the json module, but it's optional
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from passage_id_array import PassageIDArray
+from passage_id_db import IKAT_PASSAGE_COUNT, PassageIDDatabase
+from passage_validator import open_passage_ids
+from utils import (
+    check_passage_provenances,
+    check_passages,
+    check_ptkb_provenance,
+    check_response,
+    ValidationFatal,
+    get_passage_ids,
+    lookup_passages,
+    validate_passages,
+)
 
 sys.path.append("./compiled_protobufs")
 from passage_validator_pb2_grpc import PassageValidatorStub
-from run_pb2 import Turn, iKATRun
+from run_pb2 import PassageProvenance, Response, Turn, iKATRun
 
 # a default timeout for gRPC calls to the passage validator
 GRPC_DEFAULT_TIMEOUT = 3.0
@@ -26,6 +48,15 @@ EXPECTED_RUN_TURN_COUNT = 218
 
 VALID_RUN_TYPES = set(["automatic", "manual", "only_response"])
 
+# the maximum number of passage provenances a response should have
+MAX_PASSAGE_PROVENANCES = 1000
+
+# the top-level fields every JSON run file must have
+REQUIRED_RUN_FIELDS = frozenset(["run_name", "run_type", "turns"])
+
+# run files with this extension contain a binary serialized iKATRun message instead of JSON
+PROTOBUF_RUN_FILE_EXTENSION = ".pb"
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -49,86 +80,236 @@ def get_stub(ip: str = "localhost", port: int = 8000) -> PassageValidatorStub |
     return passage_validation_client
 
 
-def load_topic_data(path: str) -> dict[str, dict[str, Any]]:
+def read_file(path: str | os.PathLike | IO[bytes]) -> bytes:
+    """
+    Return the content of a file given either its path or an open binary file object.
+    """
+    if isinstance(path, (str, os.PathLike)):
+        with open(path, "rb") as f:
+            return f.read()
+    return path.read()
+
+
+def load_topic_data(path: str | os.PathLike | IO[bytes]) -> dict[str, dict[str, Any]]:
     """
-    Load the test topics JSON file.
+    Load the test topics JSON file, from a path or an open binary file object.
+
+    The result for a path is cached until the file is modified, so the same
+    dict is returned by repeated calls and must be treated as read-only.
 
     Returns the content as a dict.
     """
+    if not isinstance(path, (str, os.PathLike)):
+        return _parse_topic_data(path)
+
     if not os.path.exists(path):
         logger.error(f"Topics file {path} not found!")
         raise Exception(f"Topics file {path} not found!")
 
+    return _load_topic_data_cached(os.fspath(path), os.stat(path).st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_topic_data_cached(path: str, mtime_ns: int) -> dict[str, dict[str, Any]]:
+    """
+    Parse a topics file, with the modification time as part of the cache key.
+    """
+    return _parse_topic_data(path)
+
+
+def _parse_topic_data(path: str | IO[bytes]) -> dict[str, dict[str, Any]]:
+    """
+    Parse and check the content of a topics JSON file.
+    """
     try:
-        topic_data = json.load(open(path, "r"))
+        topic_data = json_loads(read_file(path))
     except Exception as e:
         logger.error(f"Failed to load topics JSON data from {path}, exception: {e}")
         sys.exit(255)
 
     # check that topics were loaded correctly
+    if not isinstance(topic_data, list):
+        logger.error("Topics file not loaded correctly (expected a list of topics)")
+        sys.exit(255)
+
     if len(topic_data) != EXPECTED_TOPIC_ENTRIES:
         logger.error(
             f"Topics file not loaded correctly (found {len(topic_data)} entries, expected {EXPECTED_TOPIC_ENTRIES})"
         )
         sys.exit(255)
 
-    total_turns = sum(len(topic_data[i]["turns"]) for i in range(len(topic_data)))
+    try:
+        # build a dict of the topics with "number" as the key
+        topics_dict = {topic["number"]: topic for topic in topic_data}
+        total_turns = sum(len(topic["turns"]) for topic in topic_data)
+    except (KeyError, TypeError) as e:
+        logger.error(f"Topics file not loaded correctly (invalid topic entry: {e!r})")
+        sys.exit(255)
+
     if total_turns != EXPECTED_RUN_TURN_COUNT:
         logger.error(
             f"Topics file not loaded correctly (found {total_turns} turns, expected {EXPECTED_RUN_TURN_COUNT} turns)"
         )
 
-    # build a dict of the topics with "number" as the key
-    topics_dict = {d["number"]: d for d in topic_data}
     return topics_dict
 
 
-def load_run_file(run_file_path: str) -> iKATRun:
+def _bool_value(value: Any) -> bool | None:
     """
-    Loads the selected run file.
+    Return a bool field value from a run file, raising TypeError for values ParseDict would reject.
+    """
+    # the message constructors would also accept ints here
+    if value is not None and type(value) is not bool:
+        raise TypeError(f"Expected a bool value, got {value!r}")
+    return value
+
+
+def _int_value(value: Any) -> int | None:
+    """
+    Return an integer field value from a run file, raising an exception for values ParseDict would reject.
+    """
+    # ParseDict accepts integers written as strings (PTKB provenance IDs usually are)
+    if type(value) is str and " " not in value:
+        return int(value)
+    # the message constructors would also accept bools here
+    if value is not None and type(value) is not int:
+        raise TypeError(f"Expected an integer value, got {value!r}")
+    return value
+
+
+def _list_value(value: Any) -> list[Any]:
+    """
+    Return a repeated field value from a run file, raising TypeError if it isn't a list.
+    """
+    if value is None:
+        return []
+    if type(value) is not list:
+        raise TypeError(f"Expected a list, got {value!r}")
+    return value
+
+
+def _build_response(response: dict[str, Any]) -> Response:
+    """
+    Build a Response message from its entry in a run file (see build_run).
+    """
+    passage_provenance = []
+    for provenance in _list_value(response.get("passage_provenance")):
+        _bool_value(provenance.get("used"))
+        passage_provenance.append(PassageProvenance(**provenance))
+
+    # ParseDict rejects scores that are NaN or out of range for a float, which
+    # the constructor would store as NaN/infinity
+    if not all(math.isfinite(provenance.score) for provenance in passage_provenance):
+        raise ValueError("Invalid passage provenance score")
+
+    return Response(
+        **{
+            **response,
+            "rank": _int_value(response.get("rank")),
+            "passage_provenance": passage_provenance,
+            "ptkb_provenance": [_int_value(ptkb_prov) for ptkb_prov in _list_value(response.get("ptkb_provenance"))],
+        }
+    )
+
+
+def build_run(run: dict[str, Any]) -> iKATRun:
+    """
+    Build an iKATRun object from the parsed JSON content of a run file.
+
+    ParseDict is slow for large runs because it converts every field through
+    protobuf's reflection API. This builds the messages directly with their
+    constructors, which is several times faster. The constructors are more
+    lenient than ParseDict for a few types of values, so those are checked
+    here. Anything else that ParseDict handles differently (e.g. camelCase
+    field names, numbers written as strings) raises an exception.
+
+    load_run_file falls back to ParseDict if this raises an exception, so the
+    result is always the same as ParseDict's.
+    """
+    turns = [
+        Turn(**{**turn, "responses": [_build_response(response) for response in _list_value(turn.get("responses"))]})
+        for turn in _list_value(run.get("turns"))
+    ]
+    return iKATRun(**{**run, "eval_response": _bool_value(run.get("eval_response")), "turns": turns})
+
+
+def load_run_file(run_file_path: str | os.PathLike | IO[bytes]) -> iKATRun:
+    """
+    Loads the selected run file, from a path or an open binary file object.
 
     The file is first opened and parsed as JSON. A couple of simple checks
     for expected top-level fields like "run_name" and "run_type" are made.
-    After that the content is passed to ParseDict to populate a protobuf
-    iKATRun object. This should generate an exception if there are any
-    unexpected/missing fields in the JSON data.
+    After that the content is used to populate a protobuf iKATRun object, using
+    build_run or ParseDict if that fails. This should generate an exception
+    if there are any unexpected/missing fields in the JSON data.
+
+    Files with a PROTOBUF_RUN_FILE_EXTENSION extension are parsed directly
+    as a binary iKATRun message instead, skipping the JSON steps.
 
     Returns a populated iKATRun object (see protocol_buffers/run.proto).
     """
+    content = read_file(run_file_path)
+    is_protobuf = isinstance(run_file_path, (str, os.PathLike)) and os.fspath(run_file_path).endswith(
+        PROTOBUF_RUN_FILE_EXTENSION
+    )
+
     # validate structure
-    with open(run_file_path, "r", encoding="utf-8") as run_file:
-        try:
-            run = json.load(run_file)
-            # check for expected attributes
-            if "run_name" not in run or "run_type" not in run:
-                raise Exception("Missing run_name/run_type entry")
+    try:
+        if is_protobuf:
+            return iKATRun.FromString(content)
 
-            if "turns" not in run:
-                raise Exception("Missing turns entry")
+        run = json_loads(content)
+        # release the file content before building the messages, so it isn't
+        # held in memory alongside both the parsed dict and the iKATRun
+        del content
 
+        # check for expected attributes
+        if not isinstance(run, dict):
+            raise Exception("Expected a JSON object")
+
+        missing_fields = REQUIRED_RUN_FIELDS.difference(run)
+        if missing_fields:
+            raise Exception(f"Missing {'/'.join(sorted(missing_fields))} entry")
+
+        try:
+            run = build_run(run)
+        except (AttributeError, TypeError, ValueError):
+            # ParseDict handles every valid format, and gives more useful error messages
             run = ParseDict(run, iKATRun())
-        except Exception as e:
-            logger.error(f"Run file not in the right format ({e})")
-            sys.exit(255)
+    except Exception as e:
+        logger.error(f"Run file not in the right format ({e})")
+        sys.exit(255)
 
     return run
 
 
 def validate_turn(
-    run_type: str, turn: Turn, ptkb_data: dict[str, Any], stub: PassageValidatorStub | None, timeout: float
+    run_type: str,
+    turn: Turn,
+    ptkb_data: dict[str, Any],
+    stub: PassageValidatorStub | None,
+    timeout: float,
+    passage_validity: dict[str, bool] | None = None,
 ) -> tuple[int, int]:
     """
     Validate a single turn from a run.
 
+    If passage_validity is given, the passage IDs in the turn are checked against
+    it (see utils.lookup_passages) instead of calling the validation service.
+
     Returns a 2-tuple of (number of warnings, number of service errors)
     """
     warning_count, service_errors = 0, 0
 
-    logger.debug(f"Validating turn {turn.turn_id}")
+    # read the turn ID once, protobuf field access is relatively slow
+    turn_id = turn.turn_id
+    logger.debug("Validating turn %s", turn_id)
     previous_rank = 0
 
+    if passage_validity is not None:
+        warning_count += check_passages(passage_validity, logger, turn)
     # will be None if skip_passage_validation was used
-    if stub is not None:
+    elif stub is not None:
         try:
             # if passage validation is enabled, this is where we make a gRPC call to the
             # validation service to perform the passage ID checks
@@ -141,42 +322,44 @@ def validate_turn(
 
     for i, response in enumerate(turn.responses):
         # check the response:
-        warning_count += check_response(run_type, response, logger, previous_rank, turn.turn_id)
-
-        previous_score = 1e9
+        warning_count += check_response(run_type, response, logger, previous_rank, turn_id)
 
-        # check passage provenances
-        for provenance in response.passage_provenance:
-            warning_count += check_passage_provenance(previous_score, provenance, logger, turn.turn_id)
-            previous_score = provenance.score
+        passage_provenance = response.passage_provenance
+        ptkb_provenance = response.ptkb_provenance
 
-        passages_used = [p.used for p in response.passage_provenance if p.used]
+        # check passage provenances, counting the ones marked as used in the same pass
+        provenance_warnings, passages_used = check_passage_provenances(passage_provenance, logger, turn_id)
+        warning_count += provenance_warnings
 
-        if len(passages_used) == 0:
+        if passages_used == 0:
             logger.warning(
-                f'Turn {turn.turn_id}, response #{i} has no passages marked as "used"! The top 5 passages will be used as provenance by default'
+                'Turn %s, response #%d has no passages marked as "used"! '
+                "The top 5 passages will be used as provenance by default",
+                turn_id,
+                i,
             )
             warning_count += 1
 
-        if len(response.passage_provenance) == 0:
-            logger.warning(f"Turn {turn.turn_id} has a response with no passage provenances")
+        if len(passage_provenance) == 0:
+            logger.warning("Turn %s has a response with no passage provenances", turn_id)
             warning_count += 1
-        elif len(response.passage_provenance) > 1000:
-            logger.warning(f"Turn {turn.turn_id} has a response with >1000 passages ({len(response.passage_provenance)})")
+        elif len(passage_provenance) > MAX_PASSAGE_PROVENANCES:
+            logger.warning(
+                "Turn %s has a response with >%d passages (%d)", turn_id, MAX_PASSAGE_PROVENANCES, len(passage_provenance)
+            )
             warning_count += 1
 
-        if len(response.ptkb_provenance) == 0:
-            logger.warning(f"No PTKB provenances listed for a response in turn {turn.turn_id}!")
+        if len(ptkb_provenance) == 0:
+            logger.warning("No PTKB provenances listed for a response in turn %s!", turn_id)
             warning_count += 1
             continue  # no point in doing the next block
 
-        for ptkb_prov in response.ptkb_provenance:
-            warning_count += check_ptkb_provenance(ptkb_prov, turn, ptkb_data, logger)
+        warning_count += sum(check_ptkb_provenance(ptkb_prov, turn, ptkb_data, logger) for ptkb_prov in ptkb_provenance)
 
     return warning_count, service_errors
 
 
-def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) -> dict[str, list[Turn]]:
+def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) -> dict[int, list[tuple[int, Turn]]]:
     """
     Given a run file, verify the number of turns.
 
@@ -185,7 +368,8 @@ def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) ->
         2. Checking that there are the correct number of turns for each topic
 
     To make subsequent topic-by-topic validation simpler, this will also pull out
-    the list of individual turns for each topic and return those.
+    the list of individual turns for each topic and return those, as (turn number,
+    Turn) tuples so the turn IDs don't have to be parsed again.
     """
 
     # we already know the number of turns in topics_dict is correct after checking
@@ -196,7 +380,7 @@ def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) ->
         sys.exit(255)
 
     # now extract the turns from the run into a dict keyed by topic ID
-    run_topics_dict: dict[str, list[Turn]] = {}
+    run_topics_dict: dict[int, list[tuple[int, Turn]]] = defaultdict(list)
     for turn in run.turns:
         try:
             # check if the turn ID looks valid and convert the components
@@ -206,10 +390,7 @@ def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) ->
             logger.error(f'Failed to parse turn ID "{turn.turn_id}", exception was {e}')
             sys.exit(255)
 
-        if topic_id not in run_topics_dict:
-            run_topics_dict[topic_id] = []
-
-        run_topics_dict[topic_id].append(turn)
+        run_topics_dict[topic_id].append((turn_id, turn))
 
     # check we have the expected number of topics from the run file
     if len(run_topics_dict) != EXPECTED_TOPIC_ENTRIES:
@@ -232,15 +413,85 @@ def validate_all_turns(run: iKATRun, topics_dict: dict[str, dict[str, Any]]) ->
     return run_topics_dict
 
 
+class _RecordCollector(logging.Handler):
+    """
+    A logging handler that keeps the records it's given, so a worker process
+    can return them to the parent to be logged there.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # format the message now, since the args may not survive pickling
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+def _validate_serialized_turns(
+    run_type: str, serialized_turns: list[bytes], ptkb_data: dict[str, Any]
+) -> list[tuple[int, int, list[logging.LogRecord]]]:
+    """
+    Validate a list of serialized Turns without passage validation (see validate_run).
+
+    This runs in a worker process, so the turns are passed as bytes. The worker
+    doesn't write any log output itself, since it may not have the parent's handlers
+    (with spawn) or would share their files with other workers (with fork). Instead
+    the records logged for each turn are returned for the parent to handle.
+
+    Returns a list of (number of warnings, number of service errors, log records) tuples, one per turn.
+    """
+    handlers, propagate = logger.handlers, logger.propagate
+    collector = _RecordCollector()
+    logger.handlers, logger.propagate = [collector], False
+
+    results = []
+    try:
+        for turn in serialized_turns:
+            warnings, service_errors = validate_turn(run_type, Turn.FromString(turn), ptkb_data, None, 0)
+            results.append((warnings, service_errors, collector.records))
+            collector.records = []
+    finally:
+        logger.handlers, logger.propagate = handlers, propagate
+
+    return results
+
+
+def _handle_worker_results(futures: list[Future]) -> Iterator[tuple[int, int]]:
+    """
+    Log the records returned by _validate_serialized_turns in the parent process.
+
+    Yields (number of warnings, number of service errors) tuples, one per turn, in turn order.
+    """
+    for future in futures:
+        for warnings, service_errors, records in future.result():
+            for record in records:
+                logger.handle(record)
+            yield warnings, service_errors
+
+
 def validate_run(
     run: iKATRun,
     topics_dict: dict[str, dict[str, Any]],
     stub: PassageValidatorStub | None,
     max_warnings: int,
     timeout: float,
+    local_db: PassageIDDatabase | PassageIDArray | None = None,
+    workers: int = 1,
 ) -> tuple[int, int, int]:
     """
     Validates a run turn-by-turn, recording warnings and errors.
+
+    If local_db is given, passage IDs are looked up in it directly instead of
+    through the gRPC validation service.
+
+    If passage validation is skipped and workers > 1, the turns of each topic
+    are validated in a pool of that many processes. The workers' log records are
+    passed back and logged here in turn order, so the output is the same as
+    when validating in a single process.
     """
     total_warnings, service_errors = 0, 0
     turns_validated = 0
@@ -256,17 +507,65 @@ def validate_run(
         total_warnings += 1
 
     run_topics_dict = validate_all_turns(run, topics_dict)
+    run_type = run.run_type
+
+    # will be None if skip_passage_validation was used
+    passage_validity = None
+    if local_db is not None:
+        passage_ids = get_passage_ids(run.turns)
+        passage_validity = dict(zip(passage_ids, local_db.validate(passage_ids), strict=True))
+    elif stub is not None:
+        try:
+            # check the passage IDs from every turn with the validation service up front,
+            # rather than making a separate gRPC call for each turn. The timeout applies
+            # to each batch of IDs sent, not to the whole call
+            passage_validity = lookup_passages(stub, get_passage_ids(run.turns), timeout)
+        except grpc.RpcError as rpce:
+            logger.warning(
+                f"A gRPC error occurred when validating passages (name={rpce.code().name}, message={rpce.details()})"
+            )
+            # always abort if a passage ID validation error occurs
+            logger.error("Validation service errors encountered")
+            sys.exit(255)
+        except ValidationFatal as e:
+            logger.error(str(e))
+            sys.exit(255)
 
+    # check the turn IDs and look up the PTKB for each topic before validating any turns
+    topic_ptkbs = {}
     for topic_id, topic_data in run_topics_dict.items():
-        for turn in topic_data:
-            topic_id, turn_id = list(map(int, turn.turn_id.split("_")))
+        topic = topics_dict[topic_id]
+        max_turn_id = len(topic["turns"])
+        topic_ptkbs[topic_id] = topic["ptkb"]
 
-            max_turn_id = len(topics_dict[topic_id]["turns"])
+        for turn_id, turn in topic_data:
             if turn_id < 1 or turn_id > max_turn_id:
                 logger.error(f"Turn {turn.turn_id} has an invalid turn ID {turn_id}, expected range: 1-{max_turn_id}")
                 sys.exit(255)
 
-            _warnings, _service_errors = validate_turn(run.run_type, turn, topics_dict[topic_id]["ptkb"], stub, timeout)
+    executor = None
+    if workers > 1 and stub is None and passage_validity is None:
+        # each topic's turns are validated as a single task
+        executor = ProcessPoolExecutor(workers)
+        futures = [
+            executor.submit(
+                _validate_serialized_turns,
+                run_type,
+                [turn.SerializeToString() for _, turn in topic_data],
+                topic_ptkbs[topic_id],
+            )
+            for topic_id, topic_data in run_topics_dict.items()
+        ]
+        turn_results = _handle_worker_results(futures)
+    else:
+        turn_results = (
+            validate_turn(run_type, turn, topic_ptkbs[topic_id], stub, timeout, passage_validity)
+            for topic_id, topic_data in run_topics_dict.items()
+            for _, turn in topic_data
+        )
+
+    try:
+        for _warnings, _service_errors in turn_results:
             total_warnings += _warnings
             service_errors += _service_errors
             turns_validated += 1
@@ -279,6 +578,12 @@ def validate_run(
                 # always abort if a passage ID validation error occurs
                 logger.error("Validation service errors encountered")
                 sys.exit(255)
+    except ValidationFatal as e:
+        logger.error(str(e))
+        sys.exit(255)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
     logger.info(
         f"Validation completed on {turns_validated}/{len(run.turns)} turns with {total_warnings} warnings, {service_errors} service errors"
@@ -287,35 +592,79 @@ def validate_run(
 
 
 def validate(
-    run_file_path: str, fileroot: str, max_warnings: int, skip_validation: bool, timeout: float
+    run_file_path: str,
+    fileroot: str,
+    max_warnings: int,
+    skip_validation: bool,
+    timeout: float,
+    local_db_path: str | None = None,
+    workers: int = 1,
+    local_db_expected_rows: int = IKAT_PASSAGE_COUNT,
 ) -> tuple[int, int, int]:
     """
     Top level run validation method.
 
     Connects to the gRPC validator service, loads topic data, loads the run file,
     and then calls `validate_run` to perform the validation.
+
+    If local_db_path is given, passage IDs are validated against that database
+    (or passage ID array) directly and the gRPC validator service isn't used. Like
+    the service, this refuses to use a database that doesn't have
+    local_db_expected_rows rows (0 to skip the check).
+
+    workers sets the number of processes used to validate turns when passage
+    validation is skipped (see validate_run).
     """
     run_file_name = PurePath(run_file_path).name
     fileHandler = logging.FileHandler(filename=f"{run_file_name}.errlog")
     fileHandler.setFormatter(formatter)
     logger.addHandler(fileHandler)
 
-    # only instantiate the gRPC service client if skip_validation is False
-    validator_stub = None if skip_validation else get_stub()
+    # protobuf uses its upb C extension by default, but falls back to a much slower
+    # pure Python implementation if that isn't available for the platform (or if
+    # PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=python is set)
+    if api_implementation.Type() == "python":
+        logger.warning("Using the pure Python protobuf implementation, validation will be slow")
+
+    local_db = None
+    if local_db_path is not None and not skip_validation:
+        local_db = open_passage_ids(local_db_path)
+        if local_db is None:
+            logger.error(f"Failed to open passage ID database {local_db_path}")
+            raise Exception(f"Failed to open passage ID database {local_db_path}")
+
+        # a wrong or partially built file would otherwise report every missing ID as invalid
+        rowcount = local_db.cached_rowcount()
+        if local_db_expected_rows > 0 and rowcount != local_db_expected_rows:
+            local_db.close()
+            logger.error(f"Database row count of {rowcount} vs expected {local_db_expected_rows}, invalid path?")
+            raise Exception(f"Passage ID database {local_db_path} has {rowcount} rows, expected {local_db_expected_rows}")
+        skip_service = True
+    else:
+        skip_service = skip_validation
+
+    try:
+        # only instantiate the gRPC service client if it's going to be used
+        validator_stub = None if skip_service else get_stub()
 
-    if not skip_validation and validator_stub is None:
-        logger.error("Failed to set up validation service")
-        raise Exception("Failed to set up validation service")
+        if not skip_service and validator_stub is None:
+            logger.error("Failed to set up validation service")
+            raise Exception("Failed to set up validation service")
 
-    topics_dict = load_topic_data(f"{fileroot}/2024_test_topics.json")
+        topics_dict = load_topic_data(f"{fileroot}/2024_test_topics.json")
 
-    run = load_run_file(run_file_path)
+        run = load_run_file(run_file_path)
 
-    if len(run.turns) == 0:
-        logger.error("Loaded run file has 0 turns, not performing any validation!")
-        return len(run.turns), -1, -1
+        if len(run.turns) == 0:
+            logger.error("Loaded run file has 0 turns, not performing any validation!")
+            return len(run.turns), -1, -1
 
-    turns_validated, service_errors, total_warnings = validate_run(run, topics_dict, validator_stub, max_warnings, timeout)
+        turns_validated, service_errors, total_warnings = validate_run(
+            run, topics_dict, validator_stub, max_warnings, timeout, local_db, workers
+        )
+    finally:
+        if local_db is not None:
+            local_db.close()
 
     return turns_validated, service_errors, total_warnings
 
@@ -335,6 +684,28 @@ if __name__ == "__main__":
         default=GRPC_DEFAULT_TIMEOUT,
         type=float,
     )
+    _ = ap.add_argument(
+        "-d",
+        "--local_db",
+        help="Validate passage IDs against this database (or .i64 passage ID array) directly "
+        "instead of using the validator service",
+        default=None,
+    )
+    _ = ap.add_argument(
+        "-w",
+        "--workers",
+        help="Number of processes used to validate turns when passage validation is skipped",
+        type=int,
+        default=1,
+    )
     args = ap.parse_args()
 
-    _ = validate(args.path_to_run_file, args.fileroot, args.max_warnings, args.skip_passage_validation, args.timeout)
+    _ = validate(
+        args.path_to_run_file,
+        args.fileroot,
+        args.max_warnings,
+        args.skip_passage_validation,
+        args.timeout,
+        args.local_db,
+        args.workers,
+    )
@@ -0,0 +1,163 @@
+import argparse
+import logging
+import os
+import sys
+from itertools import chain
+from typing import Iterator, List, Optional
+
+import numpy as np
+import tqdm
+
+from passage_id_db import (DEFAULT_BATCH_SIZE, IKAT_PASSAGE_COUNT, batched_passage_ids, hash_passage_id,
+                           hash_passage_id_batches, read_passage_ids)
+
+LOGLEVEL = logging.INFO
+
+logger = logging.Logger(__file__)
+logger.setLevel(LOGLEVEL)
+# log to stdout and to file
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.addHandler(logging.FileHandler(__file__ + '.log'))
+
+def _track_progress(batches: Iterator[List[int]], progress: tqdm.tqdm) -> Iterator[List[int]]:
+    """
+    Pass through batches of keys, updating a progress bar as each one arrives.
+    """
+    for batch in batches:
+        progress.update(len(batch))
+        yield batch
+
+class PassageIDArray:
+    """
+    A read-only alternative to PassageIDDatabase.
+
+    The passage IDs are stored as a sorted array of the same 64-bit hashes used
+    by PassageIDDatabase, written to a flat file with no header. The file is
+    memory-mapped when opened so the OS page cache can be shared between
+    processes, and a batch of IDs is validated with a single np.searchsorted call.
+    """
+
+    FILE_EXTENSION = '.i64'
+    DTYPE = np.int64
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._arr: Optional[np.memmap] = None
+
+    def open(self, readonly: bool = True) -> bool:
+        """
+        Memory-map an existing array file at the location given by self.path.
+
+        The array is always read-only, the readonly parameter is only accepted for
+        compatibility with PassageIDDatabase.open.
+        """
+        try:
+            self._arr = np.memmap(self.path, dtype=PassageIDArray.DTYPE, mode='r')
+        except (OSError, ValueError) as err:
+            logger.error(f'Error opening passage ID array: {err}')
+            return False
+
+        return True
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def populate(self, hash_file: str, num_lines: int = IKAT_PASSAGE_COUNT, workers: int = 1) -> bool:
+        """
+        Create the array file from a .tsv file.
+
+        Rows are expected to contain ClueWeb22-ID<tab>passage number<tab>passage hash.
+
+        The whole array is built and sorted in memory (8 bytes per passage) before
+        being written out, then the new file is opened. The hashes are computed by a
+        pool of worker processes if workers > 1.
+        """
+        self.close()
+
+        with tqdm.tqdm(total=num_lines) as progress:
+            batches = hash_passage_id_batches(batched_passage_ids(read_passage_ids(hash_file), DEFAULT_BATCH_SIZE), workers)
+            keys = np.fromiter(chain.from_iterable(_track_progress(batches, progress)), dtype=PassageIDArray.DTYPE)
+
+        keys.sort()
+        if len(keys) > 1 and np.any(keys[1:] == keys[:-1]):
+            # either a duplicate row in the .tsv file or (very unlikely) two IDs with the same hash
+            logger.error('Duplicate passage ID key while populating the array')
+            return False
+
+        keys.tofile(self.path)
+        logger.info(f'Array populated with {len(keys)} rows')
+        return self.open()
+
+    def validate(self, ids: List[str]) -> List[bool]:
+        """
+        Check a list of passage IDs are in the array.
+
+        Expects a list of passage IDs in the standard ClueWeb22-ID:passage number format.
+
+        Returns a list of bools the same size as the input list indicating if each ID is valid/invalid.
+        """
+        if self._arr is None:
+            raise Exception('Passage ID array has not been opened')
+
+        keys = np.fromiter((hash_passage_id(id) for id in ids), dtype=PassageIDArray.DTYPE, count=len(ids))
+        # the position each key would be inserted at is the position of the
+        # matching entry if the key is present
+        idx = np.searchsorted(self._arr, keys)
+        valid = idx < len(self._arr)
+        valid[valid] = self._arr[idx[valid]] == keys[valid]
+        return valid.tolist()
+
+    def close(self) -> bool:
+        """
+        Close the memory-mapped file if it's currently open.
+        """
+        self._arr = None
+        return True
+
+    def rowcount(self) -> int:
+        """
+        Returns the number of passage IDs in the array.
+        """
+        if self._arr is None:
+            raise Exception('Passage ID array has not been opened')
+
+        return len(self._arr)
+
+    def cached_rowcount(self) -> int:
+        """
+        Returns the number of passage IDs in the array. This is the same as
+        rowcount(), which is already cheap for an array.
+        """
+        return self.rowcount()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('hash_file')
+    parser.add_argument(
+        '-w',
+        '--workers',
+        help='Number of processes to use for hashing passage IDs',
+        type=int,
+        default=os.cpu_count(),
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.hash_file):
+        print(f'Error: {args.hash_file} does not exist!')
+        sys.exit(255)
+
+    # create the array in same location as the input, replacing the extension
+    array_name, _ = os.path.splitext(args.hash_file)
+    array_name = array_name + PassageIDArray.FILE_EXTENSION
+    print(f'Creating passage ID array at {array_name}')
+
+    pia = PassageIDArray(array_name)
+    if not pia.populate(args.hash_file, workers=args.workers):
+        print('Error: failed to populate the array!')
+        sys.exit(255)
+
+    print(f'Array populated, row count is {pia.rowcount()}')
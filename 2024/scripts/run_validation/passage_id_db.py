@@ -1,10 +1,15 @@
 import argparse
-import csv
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
+import pathlib
 import sqlite3
 import sys
-from typing import List, Optional
+import threading
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Union
 
 import tqdm
 
@@ -14,6 +19,64 @@ IKAT_PASSAGE_COUNT = 116838987
 # default number of rows to insert into a single insert when building the database
 DEFAULT_BATCH_SIZE = 20000
 
+# database schema versions, stored in the SQLite user_version field:
+# - SCHEMA_TEXT_IDS stores the passage IDs as TEXT primary keys (databases created before versioning was added)
+# - SCHEMA_HASHED_IDS stores a signed 64-bit hash of each passage ID as an INTEGER primary key, which
+#   gives a much smaller table with integer comparisons instead of string comparisons for lookups
+SCHEMA_TEXT_IDS = 0
+SCHEMA_HASHED_IDS = 1
+
+def read_passage_ids(hash_file: str) -> Iterator[str]:
+    """
+    Read the passage IDs from a .tsv file.
+
+    Rows are expected to contain ClueWeb22-ID<tab>passage number<tab>passage hash,
+    yields IDs in the standard ClueWeb22-ID:passage number format.
+    """
+    with open(hash_file, 'r') as hf:
+        for line in hf:
+            clueweb_id, passage_num, _ = line.split('\t', 2)
+            yield f'{clueweb_id}:{passage_num}'
+
+def hash_passage_id(id: str) -> int:
+    """
+    Return the signed 64-bit integer key used for a passage ID in a SCHEMA_HASHED_IDS database.
+    """
+    return int.from_bytes(hashlib.blake2b(id.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+def hash_passage_id_batch(ids: List[str]) -> List[int]:
+    """
+    Return the keys for a list of passage IDs (see hash_passage_id).
+    """
+    return [hash_passage_id(id) for id in ids]
+
+def batched_passage_ids(ids: Iterable[str], batch_size: int) -> Iterator[List[str]]:
+    """
+    Split a sequence of passage IDs into lists of up to batch_size IDs.
+    """
+    # take a single iterator up front, so each batch continues from where the last one stopped
+    it = iter(ids)
+    return iter(lambda: list(islice(it, batch_size)), [])
+
+def hash_passage_id_batches(batches: Iterator[List[str]], workers: int = 1) -> Iterator[List[int]]:
+    """
+    Hash batches of passage IDs, returning the batches of keys in the same order.
+
+    If workers > 1 the hashing is spread over a pool of processes. Only workers * 2
+    batches are handed to the pool at a time, so the input isn't read any faster
+    than the keys are being consumed.
+    """
+    if workers <= 1:
+        yield from map(hash_passage_id_batch, batches)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        while True:
+            group = list(islice(batches, workers * 2))
+            if len(group) == 0:
+                break
+            yield from pool.map(hash_passage_id_batch, group)
+
 LOGLEVEL = logging.INFO
 
 logger = logging.Logger(__file__)
@@ -27,20 +90,68 @@ class PassageIDDatabase:
     TABLE_NAME = 'passage_ids'
     COL_NAME = 'id'
 
+    # SQL statements are built once here rather than on every call
+    SQL_DROP_TABLE = f'DROP TABLE IF EXISTS {TABLE_NAME}'
+    SQL_CREATE_TABLE = {
+        SCHEMA_TEXT_IDS: f'CREATE TABLE {TABLE_NAME} ({COL_NAME} TEXT PRIMARY KEY NOT NULL)',
+        SCHEMA_HASHED_IDS: f'CREATE TABLE {TABLE_NAME} ({COL_NAME} INTEGER PRIMARY KEY NOT NULL)',
+    }
+    SQL_INSERT = f'INSERT INTO {TABLE_NAME} VALUES (?)'
+    # the IDs to validate are passed in as a JSON array and expanded by json_each
+    SQL_VALIDATE = f'SELECT {COL_NAME} FROM {TABLE_NAME} WHERE {COL_NAME} IN (SELECT value FROM json_each(?))'
+    SQL_ROWCOUNT = f'SELECT COUNT({COL_NAME}) FROM {TABLE_NAME}'
+
+    # a key/value table for information about the database recorded when it's
+    # populated, currently just the number of rows (counting them is slow)
+    METADATA_TABLE_NAME = 'metadata'
+    METADATA_ROWCOUNT = 'rowcount'
+    SQL_DROP_METADATA = f'DROP TABLE IF EXISTS {METADATA_TABLE_NAME}'
+    SQL_CREATE_METADATA = f'CREATE TABLE {METADATA_TABLE_NAME} (k TEXT PRIMARY KEY NOT NULL, v INTEGER)'
+    SQL_SET_METADATA = f'INSERT OR REPLACE INTO {METADATA_TABLE_NAME} VALUES (?, ?)'
+    SQL_GET_METADATA = f'SELECT v FROM {METADATA_TABLE_NAME} WHERE k = ?'
+
+    # settings for read-only connections:
+    # - memory-map the file so pages are read straight from the OS page cache
+    #   instead of being copied into SQLite's own cache (SQLite caps this at
+    #   its compile-time limit if that's lower)
+    # - increase the default page cache size to 256MB for any remaining reads
+    # - reject any statements that would modify the database
+    READONLY_PRAGMAS = [
+        'PRAGMA mmap_size = 32212254720',
+        'PRAGMA cache_size = -262144',
+        'PRAGMA query_only = 1',
+    ]
+
     def __init__(self, path: str) -> None:
         self.path = path
+        self.schema_version = SCHEMA_TEXT_IDS
         self._conn: Optional[sqlite3.Connection] = None
+        # holds a cursor for each thread using the connection (see _cursor)
+        self._local = threading.local()
 
-    def open(self) -> bool:
+    def open(self, readonly: bool = False) -> bool:
         """
         Open a database file at the location given by self.path. If there's an 
         existing file there it will be opened, otherwise a new file is created.
+
+        If readonly is True the file must already exist, and the connection is
+        configured for lookups only (see READONLY_PRAGMAS).
         """
+        self._local = threading.local()
         try:
             # using check_same_thread=False should be safe here because the
             # database is either going to be populated or used for reads, not
             # both at the same time
-            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            if readonly:
+                # immutable=1 tells SQLite the file can't change while it's open,
+                # so it can skip all locking and change detection
+                uri = pathlib.Path(self.path).absolute().as_uri() + '?mode=ro&immutable=1'
+                self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                for pragma in PassageIDDatabase.READONLY_PRAGMAS:
+                    self._conn.execute(pragma)
+            else:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.schema_version = self._conn.execute('PRAGMA user_version').fetchone()[0]
         except sqlite3.Error as sqle:
             logger.error(f'Error initialising database: {sqle}')
             return False
@@ -54,13 +165,22 @@ class PassageIDDatabase:
     def __exit__(self, type, value, traceback):
         self.close()
 
-    def populate(self, hash_file: str, batch_size: int, num_lines: int = IKAT_PASSAGE_COUNT) -> bool:
+    def populate(
+        self,
+        hash_file: str,
+        batch_size: int,
+        num_lines: int = IKAT_PASSAGE_COUNT,
+        schema_version: int = SCHEMA_HASHED_IDS,
+        workers: int = 1,
+    ) -> bool:
         """
         Populate the database from a .tsv file.
 
         Rows are expected to contain ClueWeb22-ID<tab>passage number<tab>passage hash.
         
-        Inserts are done in transactions of batch_size rows.
+        Inserts are done in transactions of batch_size rows. The passage IDs are stored
+        according to schema_version, by default as 64-bit hashes. The hashes are computed
+        by a pool of worker processes if workers > 1, with this process doing all the inserts.
         """
 
         if self._conn is None:
@@ -69,11 +189,14 @@ class PassageIDDatabase:
         # since we're (re)populating, (re)create the schema
         cur = self._conn.cursor()
         try:
-            cur.execute(f'DROP TABLE IF EXISTS {PassageIDDatabase.TABLE_NAME}')
-            cur.execute(f'CREATE TABLE {PassageIDDatabase.TABLE_NAME} ({PassageIDDatabase.COL_NAME} TEXT PRIMARY KEY NOT NULL)')
+            cur.execute(PassageIDDatabase.SQL_DROP_TABLE)
+            cur.execute(PassageIDDatabase.SQL_DROP_METADATA)
+            cur.execute(PassageIDDatabase.SQL_CREATE_TABLE[schema_version])
+            cur.execute(f'PRAGMA user_version = {schema_version:d}')
         except sqlite3.Error as sqle:
             logger.error(f'Error initialising database: {sqle}')
             return False
+        self.schema_version = schema_version
 
         # try to speed up the inserts a little:
         # - increase the default page cache size
@@ -85,28 +208,33 @@ class PassageIDDatabase:
         cur.execute('PRAGMA synchronous = OFF')
         cur.execute('PRAGMA temp_store = MEMORY')
 
-        batch = []
+        batches = batched_passage_ids(read_passage_ids(hash_file), batch_size)
+        if schema_version == SCHEMA_HASHED_IDS:
+            batches = hash_passage_id_batches(batches, workers)
+
         inserted = 0
-        batch_count = 0
         with tqdm.tqdm(total=num_lines) as progress:
-            with open(hash_file, 'r') as hf:
-                rdr = csv.reader(hf, delimiter='\t')
-                for row in rdr:
-                    batch.append((f'{row[0]}:{row[1]}', ))
-
-                    if len(batch) == batch_size:
-                        cur.executemany(f'INSERT INTO {PassageIDDatabase.TABLE_NAME} VALUES (?)', batch)
-                        progress.update(len(batch))
-                        self._conn.commit()
-                        inserted += len(batch)
-                        batch_count += 1
-                        batch = []
-
-                # final partial batch
-                cur.executemany(f'INSERT INTO {PassageIDDatabase.TABLE_NAME} VALUES (?)', batch)
-                self._conn.commit()
-                inserted += len(batch)
-                progress.update(len(batch))
+            try:
+                for batch in batches:
+                    # inserting each batch in key order touches fewer B-tree pages than
+                    # inserting the (effectively random) hashes in file order
+                    batch.sort()
+                    cur.executemany(PassageIDDatabase.SQL_INSERT, ((key, ) for key in batch))
+                    self._conn.commit()
+                    inserted += len(batch)
+                    progress.update(len(batch))
+            except sqlite3.IntegrityError as sqle:
+                # the primary key rejects duplicates, so this means either a duplicate
+                # row in the .tsv file or (very unlikely) two IDs with the same hash
+                logger.error(f'Duplicate passage ID key while populating the database: {sqle}')
+                if schema_version == SCHEMA_HASHED_IDS:
+                    logger.error('If the .tsv file has no duplicate rows, rebuild the database with --text_ids')
+                return False
+
+            # record the row count so it doesn't have to be counted when the database is opened
+            cur.execute(PassageIDDatabase.SQL_CREATE_METADATA)
+            cur.execute(PassageIDDatabase.SQL_SET_METADATA, (PassageIDDatabase.METADATA_ROWCOUNT, inserted))
+            self._conn.commit()
 
             logger.info(f'Database populated with {inserted} rows, vacuuming...')
             self._conn.execute('VACUUM')
@@ -124,17 +252,40 @@ class PassageIDDatabase:
         if self._conn is None:
             raise Exception('Database connection has not been opened')
 
-        results = []
-        cur = self._conn.cursor()
-        for id in ids:
-            cur.execute(f'SELECT {PassageIDDatabase.COL_NAME} FROM {PassageIDDatabase.TABLE_NAME} \
-                    WHERE {PassageIDDatabase.COL_NAME} = ?', (id, ))
-            result = cur.fetchone()
-            results.append(False if result is None else True)
-            logger.debug(f'Validate {id} = {result is not None}')
+        keys = [self._key(id) for id in ids]
+
+        # look up all the IDs in a single query instead of one query per ID. The IDs
+        # are passed in as a JSON array and expanded by json_each, so there's no
+        # limit on the number of IDs like there would be with bound parameters
+        cur = self._cursor()
+        cur.execute(PassageIDDatabase.SQL_VALIDATE, (json.dumps(keys), ))
+        found = {row[0] for row in cur}
+
+        return [key in found for key in keys]
+
+    def _cursor(self) -> sqlite3.Cursor:
+        """
+        Return a cursor for the calling thread, creating it on first use.
+
+        Cursors are reused between calls rather than created for every lookup. The
+        validator service calls validate from multiple threads, so each thread gets
+        its own cursor to stop one thread's query replacing another's results.
+        """
+        if self._conn is None:
+            raise Exception('Database connection has not been opened')
 
-        cur.close()
-        return results
+        cur = getattr(self._local, 'cur', None)
+        if cur is None:
+            cur = self._local.cur = self._conn.cursor()
+        return cur
+
+    def _key(self, id: str) -> Union[str, int]:
+        """
+        Return the primary key value stored for a passage ID in this database.
+        """
+        if self.schema_version == SCHEMA_HASHED_IDS:
+            return hash_passage_id(id)
+        return id
 
     def close(self) -> bool:
         """
@@ -152,18 +303,60 @@ class PassageIDDatabase:
         if self._conn is None:
             raise Exception('Database connection has not been opened')
 
-        cur = self._conn.cursor()
+        cur = self._cursor()
         try:
-            cur.execute(f'SELECT COUNT({PassageIDDatabase.COL_NAME}) FROM {PassageIDDatabase.TABLE_NAME}')
+            cur.execute(PassageIDDatabase.SQL_ROWCOUNT)
         except sqlite3.OperationalError as sqle:
             logger.error(f'Failed to get row count: {sqle}')
             return -1
         return cur.fetchone()[0]
 
+    def cached_rowcount(self) -> int:
+        """
+        Returns the number of rows in the database as recorded when it was populated.
+
+        This avoids counting all the rows, which takes a long time for the full
+        collection. Databases without a recorded row count (created by earlier
+        versions of this script) fall back to rowcount().
+        """
+        if self._conn is None:
+            raise Exception('Database connection has not been opened')
+
+        cur = self._cursor()
+        try:
+            cur.execute(PassageIDDatabase.SQL_GET_METADATA, (PassageIDDatabase.METADATA_ROWCOUNT, ))
+            row = cur.fetchone()
+        except sqlite3.OperationalError:
+            # no metadata table
+            row = None
+
+        if row is None:
+            return self.rowcount()
+        return row[0]
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('hash_file')
-    parser.add_argument('-b', '--batch_size', help='Number of rows in each insert transaction', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        '-b',
+        '--batch_size',
+        help='Number of rows in each insert transaction',
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        help='Number of processes to use for hashing passage IDs',
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        '-t',
+        '--text_ids',
+        help='Store the full passage ID strings instead of 64-bit hashes (larger, slower database)',
+        action='store_true',
+    )
     args = parser.parse_args()
 
     if not os.path.exists(args.hash_file):
@@ -179,7 +372,8 @@ if __name__ == "__main__":
         os.unlink(db_name)
 
     with PassageIDDatabase(db_name) as hdb:
-        if not hdb.populate(args.hash_file, args.batch_size):
+        schema_version = SCHEMA_TEXT_IDS if args.text_ids else SCHEMA_HASHED_IDS
+        if not hdb.populate(args.hash_file, args.batch_size, schema_version=schema_version, workers=args.workers):
             print('Error: failed to populate the database!')
             sys.exit(255)
 
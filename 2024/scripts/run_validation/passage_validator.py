@@ -1,40 +1,102 @@
 import sys
+import threading
+from typing import Iterator, List, Optional, Union
 
 import grpc
 
+from passage_id_array import PassageIDArray
 from passage_id_db import PassageIDDatabase
 
 sys.path.append('./compiled_protobufs')
 from passage_validator_pb2 import PassageValidation, PassageValidationRequest, PassageValidationResult
 from passage_validator_pb2_grpc import PassageValidatorServicer
 
+def open_passage_ids(db_path: str) -> Optional[Union[PassageIDArray, PassageIDDatabase]]:
+    """
+    Open a file of passage IDs read-only for lookups.
+
+    Passage IDs can be looked up in either an SQLite database or a sorted array
+    of passage ID hashes, depending on the file extension.
+
+    Returns None if the file can't be opened.
+    """
+    if db_path.endswith(PassageIDArray.FILE_EXTENSION):
+        db = PassageIDArray(db_path)
+    else:
+        db = PassageIDDatabase(db_path)
+    if not db.open(readonly=True):
+        return None
+    return db
+
 class PassageValidator(PassageValidatorServicer):
 
     def __init__(self, db_path: str, expected_rows: int) -> None:
-        self.db = PassageIDDatabase(db_path)
-        if not self.db.open():
+        db = open_passage_ids(db_path)
+        if db is None:
             print('Error: failed to open database, service cannot start!')
             sys.exit(255)
+        self.db = db
 
-        if expected_rows > 0 and self.db.rowcount() != expected_rows:
-            print(f'Error: Database row count of {self.db.rowcount()} vs expected {expected_rows}, invalid path?')
+        # the cached row count avoids counting the rows in the database at every startup
+        if expected_rows > 0 and (rowcount := self.db.cached_rowcount()) != expected_rows:
+            print(f'Error: Database row count of {rowcount} vs expected {expected_rows}, invalid path?')
             sys.exit(255)
 
+        # the service handles requests on a pool of threads, each of which opens its
+        # own connection to an SQLite database on first use (see _thread_db)
+        self._local = threading.local()
+
         print('>> Service ready')
 
+    def _thread_db(self):
+        """
+        Return the passage ID lookup object to use for the calling thread.
+
+        SQLite databases get a separate read-only connection for each thread so
+        lookups from different requests can run in parallel instead of queueing
+        on a single connection. A passage ID array is just a memory-mapped file
+        with no connection state, so it's shared by all threads.
+        """
+        if isinstance(self.db, PassageIDArray):
+            return self.db
+
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = PassageIDDatabase(self.db.path)
+            if not db.open(readonly=True):
+                raise Exception(f'Failed to open database {self.db.path}')
+            self._local.db = db
+        return db
+
     def validate_passages(self, request: PassageValidationRequest, context: grpc.ServicerContext) -> PassageValidationResult:
         """
         Takes in a list of passage ids and checks if they appear in the database
         """
+        return self._validate(request.passage_ids)
+
+    def validate_passages_stream(
+        self, request_iterator: Iterator[PassageValidationRequest], context: grpc.ServicerContext
+    ) -> Iterator[PassageValidationResult]:
+        """
+        Takes in a stream of lists of passage ids and checks if they appear in the database,
+        returning a result for each list as soon as it has been checked
+        """
+        for request in request_iterator:
+            yield self._validate(request.passage_ids)
+
+    def _validate(self, passage_ids: List[str]) -> PassageValidationResult:
+        """
+        Check a list of passage IDs and package the results for either service method
+        """
         passage_validation_result = PassageValidationResult()
 
         # query database with the set of passage IDs and return a list of bools
         # indicate valid/invalid for each ID
-        validation_results = self.db.validate(request.passage_ids)
+        validation_results = self._thread_db().validate(passage_ids)
 
-        for result in validation_results:
-            passage_validation = PassageValidation()
-            passage_validation.is_valid = result
-            passage_validation_result.passage_validations.append(passage_validation)
+        # add all the results in one call rather than appending them one at a time
+        passage_validation_result.passage_validations.extend(
+            PassageValidation(is_valid=result) for result in validation_results
+        )
 
         return passage_validation_result
@@ -1,8 +1,15 @@
-import csv
 import json
 import argparse
 import sys
 import random
+from typing import Any
+
+# orjson is much faster at writing out large runs, but it's optional
+try:
+    from orjson import dumps as json_dumps
+except ImportError:
+    def json_dumps(obj: Any, /) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
 
 random.seed(12345)
 
@@ -19,11 +26,12 @@ if __name__ == "__main__":
     parser.add_argument('-D', '--topic_data_file', help='2024 test topics JSON file path', default='../../../data/2024_test_topics.json')
     args = parser.parse_args()
 
+    # the file has no quoted fields, so splitting each line is enough to parse it
     sample_ids = []
     with open(args.sample_ids, 'r') as f:
-        rdr = csv.reader(f, delimiter='\t')
-        for line in rdr:
-            sample_ids.append(f'{line[0]}:{line[1]}')
+        for line in f:
+            clueweb_id, passage_num, _ = line.split('\t', 2)
+            sample_ids.append(f'{clueweb_id}:{passage_num}')
 
 
     with open(args.topic_data_file, 'r') as f:
@@ -51,18 +59,13 @@ if __name__ == "__main__":
                 response['rank'] = nr + 1
                 response['text'] = 'some response text'
 
-                passage_provs = []
-                ptkb_provs = []
-
                 print(f'Generating {args.num_passages} provenance entries and {args.num_ptkb} PTKB entries in response')
-                for np in range(args.num_passages):
-                    passage_prov = {}
-                    passage_prov['id'] = sample_ids[random.randint(0, len(sample_ids)-1)]
-                    passage_prov['text'] = 'some passage text'
-                    passage_prov['score'] = 1.0 / (np + 1)
-                    passage_prov['used'] = True
-                    passage_provs.append(passage_prov)
-                response['passage_provenance'] = passage_provs
+                # pick all the passage IDs for the response in one call
+                passage_ids = random.choices(sample_ids, k=args.num_passages)
+                response['passage_provenance'] = [
+                    {'id': passage_id, 'text': 'some passage text', 'score': 1.0 / (np + 1), 'used': True}
+                    for np, passage_id in enumerate(passage_ids)
+                ]
 
                 ptkbs = topic['ptkb']
                 response["ptkb_provenance"] = random.sample(range(1, len(ptkbs)+1), args.num_ptkb)
@@ -73,5 +76,5 @@ if __name__ == "__main__":
 
     run['turns'] = turns
 
-    with open(args.output, 'w') as f:
-        f.write(json.dumps(run))
+    with open(args.output, 'wb') as f:
+        f.write(json_dumps(run))
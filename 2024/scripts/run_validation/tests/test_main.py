@@ -1,14 +1,20 @@
 import copy
+import io
+import json
 import os
 import pathlib
 import sys
 
 import pytest
+from google.protobuf.json_format import ParseDict
 
+from compiled_protobufs.run_pb2 import iKATRun
 from main import (
     EXPECTED_RUN_TURN_COUNT,
     EXPECTED_TOPIC_ENTRIES,
     GRPC_DEFAULT_TIMEOUT,
+    PROTOBUF_RUN_FILE_EXTENSION,
+    build_run,
     get_stub,
     load_run_file,
     load_topic_data,
@@ -22,7 +28,8 @@ def test_get_stub(grpc_server_test):
     """
     Test instantiating the gRPC service stub.
     """
-    assert get_stub(port=8099) is not None
+    _, port = grpc_server_test
+    assert get_stub(port=port) is not None
 
 
 def test_load_topic_data(topic_data_file: str):
@@ -50,6 +57,29 @@ def test_load_invalid_topic_data(tmp_path: pathlib.PurePath):
     assert pytest_exc.value.code == 255
 
 
+def test_load_invalid_topic_data_file_object():
+    """
+    Test loading an invalid topics JSON file from a file object causes an abort.
+    """
+    with pytest.raises(SystemExit) as pytest_exc:
+        _ = load_topic_data(io.BytesIO(b'{"foo": "bar"}'))
+
+    assert pytest_exc.type is SystemExit
+    assert pytest_exc.value.code == 255
+
+
+def test_load_invalid_topic_entries():
+    """
+    Test loading a topics JSON file with malformed topic entries causes an abort.
+    """
+    json_str = "[" + ", ".join(['{"foo": "bar"}'] * EXPECTED_TOPIC_ENTRIES) + "]"
+    with pytest.raises(SystemExit) as pytest_exc:
+        _ = load_topic_data(io.BytesIO(json_str.encode()))
+
+    assert pytest_exc.type is SystemExit
+    assert pytest_exc.value.code == 255
+
+
 def test_load_missing_topic_data():
     """
     Test that loading a non-existent topics JSON file causes an abort.
@@ -66,6 +96,54 @@ def test_load_run_file(baseline_run_file: str):
     assert len(run.turns) == EXPECTED_RUN_TURN_COUNT
 
 
+def test_load_protobuf_run_file(baseline_run, tmp_path: pathlib.PurePath):
+    """
+    Test that a run file serialized as a binary protobuf loads the same as the JSON version.
+    """
+    tmp_file = tmp_path / f"run{PROTOBUF_RUN_FILE_EXTENSION}"
+    with open(tmp_file, "wb") as tf:
+        tf.write(baseline_run.SerializeToString())
+
+    assert load_run_file(str(tmp_file)) == baseline_run
+
+    # a JSON file with the protobuf extension shouldn't parse
+    with open(tmp_file, "wb") as tf:
+        tf.write(b'{"run_name": "foo", "run_type": "manual", "turns": []}')
+
+    with pytest.raises(SystemExit) as pytest_exc:
+        _ = load_run_file(str(tmp_file))
+
+    assert pytest_exc.value.code == 255
+
+
+def test_build_run(baseline_run_file: str):
+    """
+    Test that build_run creates the same iKATRun object as ParseDict.
+    """
+    with open(baseline_run_file, "r") as f:
+        run_data = json.load(f)
+
+    assert build_run(copy.deepcopy(run_data)) == ParseDict(run_data, iKATRun())
+
+
+@pytest.mark.parametrize("field,value", [("used", 1), ("score", float("inf")), ("rank", True)])
+def test_build_run_rejects_values(baseline_run_file: str, field: str, value):
+    """
+    Test that build_run rejects values that ParseDict would reject but the message constructors accept.
+    """
+    with open(baseline_run_file, "r") as f:
+        run_data = json.load(f)
+
+    response = run_data["turns"][0]["responses"][0]
+    if field == "rank":
+        response[field] = value
+    else:
+        response["passage_provenance"][0][field] = value
+
+    with pytest.raises((TypeError, ValueError)):
+        _ = build_run(run_data)
+
+
 def test_validate_invalid_run_file(tmp_path: pathlib.PurePath):
     """
     Test that loading an invalid run file causes an abort.
@@ -83,6 +161,17 @@ def test_validate_invalid_run_file(tmp_path: pathlib.PurePath):
     assert pytest_exc.value.code == 255
 
 
+def test_validate_invalid_run_file_file_object():
+    """
+    Test that loading an invalid run file from a file object causes an abort.
+    """
+    with pytest.raises(SystemExit) as pytest_exc:
+        _ = load_run_file(io.BytesIO(b'{"foo": "bar"}'))
+
+    assert pytest_exc.type is SystemExit
+    assert pytest_exc.value.code == 255
+
+
 def test_validate_run_file_missing_run_name(tmp_path: pathlib.PurePath):
     """
     Test that loading a run file with a missing run_name field causes an abort.
@@ -100,6 +189,17 @@ def test_validate_run_file_missing_run_name(tmp_path: pathlib.PurePath):
     assert pytest_exc.value.code == 255
 
 
+def test_validate_run_file_missing_run_name_file_object():
+    """
+    Test that loading a run file with a missing run_name field from a file object causes an abort.
+    """
+    with pytest.raises(SystemExit) as pytest_exc:
+        _ = load_run_file(io.BytesIO(b'{ "run_type": "manual", "turns": [] }'))
+
+    assert pytest_exc.type is SystemExit
+    assert pytest_exc.value.code == 255
+
+
 def test_validate_run_file_missing_turns(tmp_path: pathlib.PurePath):
     """
     Test that loading a run file with a missing turns field causes an abort.
@@ -117,6 +217,17 @@ def test_validate_run_file_missing_turns(tmp_path: pathlib.PurePath):
     assert pytest_exc.value.code == 255
 
 
+def test_validate_run_file_missing_turns_file_object():
+    """
+    Test that loading a run file with a missing turns field from a file object causes an abort.
+    """
+    with pytest.raises(SystemExit) as pytest_exc:
+        _ = load_run_file(io.BytesIO(b'{ "run_type": "manual", "run_name": "missing_turns"}'))
+
+    assert pytest_exc.type is SystemExit
+    assert pytest_exc.value.code == 255
+
+
 def test_validate_missing_run_file():
     """
     Test that loading a non-existent run file causes an abort.
@@ -125,11 +236,11 @@ def test_validate_missing_run_file():
         _ = load_run_file("foobar")
 
 
-def test_validate_turn(topic_data_file: str, grpc_stub_full, sample_turn):
+@pytest.mark.xdist_group(name="grpc_full")
+def test_validate_turn(topic_data, grpc_stub_full, sample_turn):
     """
     Test validation of a single turn from the baseline file.
     """
-    topic_data = load_topic_data(topic_data_file)
     topic_id = int(sample_turn.turn_id.split("_")[0])
     print(sample_turn.turn_id)
     print(topic_data[topic_id])
@@ -139,15 +250,14 @@ def test_validate_turn(topic_data_file: str, grpc_stub_full, sample_turn):
     assert service_errors == 0
 
 
-def test_validate_run(topic_data_file: str, baseline_run_file: str, grpc_stub_full, default_validate_args):
+@pytest.mark.xdist_group(name="grpc_full")
+def test_validate_run(topic_data, baseline_run, grpc_stub_full, default_validate_args):
     """
     Test validation of the whole baseline run file.
     """
     args = default_validate_args
     args.max_warnings = 0
-    topic_data = load_topic_data(topic_data_file)
-    run = load_run_file(baseline_run_file)
-    assert len(run.turns) == EXPECTED_RUN_TURN_COUNT
+    run = baseline_run
 
     turns_validated, service_errors, total_warnings = validate_run(
         run, topic_data, grpc_stub_full, args.max_warnings, args.timeout
@@ -158,15 +268,28 @@ def test_validate_run(topic_data_file: str, baseline_run_file: str, grpc_stub_fu
     assert total_warnings == 0
 
 
+def test_validate_run_local_db(topic_data, baseline_run, grpc_stub_test, sample_database, default_validate_args):
+    """
+    Test that validating passage IDs against a local database gives the same result as using the service.
+    """
+    args = default_validate_args
+    # the baseline run's passages aren't in the sample database, so there are lots of warnings
+    args.max_warnings = 1_000_000
+
+    service_result = validate_run(baseline_run, topic_data, grpc_stub_test, args.max_warnings, args.timeout)
+    local_result = validate_run(baseline_run, topic_data, None, args.max_warnings, args.timeout, sample_database)
+
+    assert local_result == service_result
+    assert local_result[0] == EXPECTED_RUN_TURN_COUNT
+
+
 @pytest.mark.skip("Currently broken")
-def test_validate_run_invalid(topic_data_file, baseline_run_file: str, grpc_stub_test_invalid, default_validate_args):
+def test_validate_run_invalid(topic_data, baseline_run, grpc_stub_test_invalid, default_validate_args):
     """
     Test validation of the run file aborts if passage validation is unavailable.
     """
     args = default_validate_args
-    topic_data = load_topic_data(topic_data_file)
-    run = load_run_file(baseline_run_file)
-    assert len(run.turns) == EXPECTED_RUN_TURN_COUNT
+    run = baseline_run
 
     # test that the script exits when it can't contact the grpc service
     with pytest.raises(SystemExit) as pytest_exc:
@@ -176,15 +299,13 @@ def test_validate_run_invalid(topic_data_file, baseline_run_file: str, grpc_stub
     assert pytest_exc.value.code == 255
 
 
-def test_validate_run_no_service(topic_data_file: str, baseline_run_file: str, default_validate_args):
+def test_validate_run_no_service(topic_data, baseline_run, default_validate_args):
     """
     Test validation of the run file works when no gRPC service is available.
     """
     args = default_validate_args
     args.max_warnings = 0
-    topic_data = load_topic_data(topic_data_file)
-    run = load_run_file(baseline_run_file)
-    assert len(run.turns) == EXPECTED_RUN_TURN_COUNT
+    run = baseline_run
 
     turns_validated, service_errors, total_warnings = validate_run(run, topic_data, None, args.max_warnings, args.timeout)
     assert turns_validated == EXPECTED_RUN_TURN_COUNT
@@ -192,31 +313,65 @@ def test_validate_run_no_service(topic_data_file: str, baseline_run_file: str, d
     assert total_warnings == 0
 
 
-def test_validate(default_validate_args, grpc_server_full):
+def test_validate_run_no_service_workers(topic_data, baseline_run, default_validate_args, caplog):
     """
-    Test the full validation process using the baseline run file.
+    Test that validating turns in multiple processes gives the same result and log output.
     """
     args = default_validate_args
+    run = iKATRun()
+    run.CopyFrom(baseline_run)
+    # generate some warnings by clearing the response texts
+    for turn in run.turns[:10]:
+        turn.responses[0].text = ""
+
+    result = validate_run(run, topic_data, None, args.max_warnings, args.timeout)
+    messages = [record.getMessage() for record in caplog.records]
+    caplog.clear()
+
+    assert validate_run(run, topic_data, None, args.max_warnings, args.timeout, workers=2) == result
+    assert [record.getMessage() for record in caplog.records] == messages
+    assert result[2] == 10
+
+
+def test_validate(local_validate_args):
+    """
+    Test the full validation process using the baseline run file.
+    """
+    args = local_validate_args
     args.max_warnings = 0
 
     turns_validated, service_errors, total_warnings = validate(
-        args.path_to_run_file, args.fileroot, args.max_warnings, args.skip_passage_validation, args.timeout
+        args.path_to_run_file,
+        args.fileroot,
+        args.max_warnings,
+        args.skip_passage_validation,
+        args.timeout,
+        args.local_db_path,
     )
     assert turns_validated == EXPECTED_RUN_TURN_COUNT
     assert service_errors == 0
     assert total_warnings == 0
 
 
+def test_validate_local_db_rowcount(default_validate_args, sample_database):
+    """
+    Test that validating against a local database with the wrong number of rows causes an abort.
+    """
+    args = default_validate_args
+
+    with pytest.raises(Exception, match="rows, expected"):
+        _, _, _ = validate(
+            args.path_to_run_file, args.fileroot, args.max_warnings, False, args.timeout, sample_database.path
+        )
+
+
 @pytest.mark.skip("Currently broken")
-def test_validate_no_service(default_validate_args, grpc_server_full_alt):
+def test_validate_no_service(default_validate_args, grpc_server_stopped):
     """
     Test the full validation process when service errors occur.
     """
     args = default_validate_args
 
-    # terminate the service
-    grpc_server_full_alt.stop(None)
-
     with pytest.raises(SystemExit) as pytest_exc:
         turns_validated, service_errors, total_warnings = validate(
             args.path_to_run_file, args.fileroot, args.max_warnings, args.skip_passage_validation, args.timeout
@@ -225,7 +380,7 @@ def test_validate_no_service(default_validate_args, grpc_server_full_alt):
     assert pytest_exc.value.code == 255
 
 
-def test_validate_no_service_skip_validation(default_validate_args, grpc_server_full_alt):
+def test_validate_no_service_skip_validation(default_validate_args, grpc_server_stopped):
     """
     Test the full validation process when passage validation is skipped
     """
@@ -233,9 +388,6 @@ def test_validate_no_service_skip_validation(default_validate_args, grpc_server_
     args.skip_passage_validation = True
     args.max_warnings = 2000
 
-    # terminate the service
-    grpc_server_full_alt.stop(None)
-
     turns_validated, service_errors, total_warnings = validate(
         args.path_to_run_file, args.fileroot, args.max_warnings, args.skip_passage_validation, args.timeout
     )
@@ -0,0 +1,48 @@
+import pathlib
+
+from passage_id_array import PassageIDArray
+
+from conftest import SAMPLE_DB_COUNT
+
+TEMP_FILE = "temp" + PassageIDArray.FILE_EXTENSION
+
+
+def test_open_missing_array(tmp_path: pathlib.PurePath):
+    """
+    Test that opening a missing file as a passage ID array will fail.
+    """
+    pia = PassageIDArray(str(tmp_path / TEMP_FILE))
+    assert not pia.open()
+
+
+def test_create_sample_array(sample_array):
+    """
+    Test that loading a sample array produces the expected rowcount, including after reopening it.
+    """
+    assert sample_array.rowcount() == SAMPLE_DB_COUNT
+
+    with PassageIDArray(sample_array.path) as pia:
+        assert pia.rowcount() == SAMPLE_DB_COUNT
+
+
+def test_validation(sample_array):
+    """
+    Test validating a set of valid and invalid IDs against the sample array.
+    """
+    passage_ids = ["clueweb22-en0004-67-04151:9", "foo", "bar", "clueweb22-en0004-50-06631:20"]
+    results = sample_array.validate(passage_ids)
+    assert results == [True, False, False, True]
+    assert sample_array.validate([]) == []
+
+
+def test_validation_bulk(sample_array, sample_ids):
+    """
+    Test validating every ID in the sample array in one call, mixed with invalid IDs.
+    """
+    passage_ids = []
+    for passage_id in sample_ids:
+        passage_ids.append(passage_id)
+        passage_ids.append(passage_id + "0000")
+
+    results = sample_array.validate(passage_ids)
+    assert results == [i % 2 == 0 for i in range(len(passage_ids))]
@@ -1,9 +1,9 @@
 import pathlib
 import os
 
-from passage_id_db import PassageIDDatabase
+from passage_id_db import PassageIDDatabase, SCHEMA_HASHED_IDS, SCHEMA_TEXT_IDS
 
-from conftest import SAMPLE_DB_COUNT
+from conftest import SAMPLE_DB_COUNT, SAMPLE_DB_PATH, SAMPLE_HASHES_PATH
 
 TEMP_FILE = "temp.sqlite3"
 
@@ -28,6 +28,24 @@ def test_create_sample_database(sample_database):
     assert sample_database.rowcount() == SAMPLE_DB_COUNT
 
 
+def test_cached_rowcount(tmp_path: pathlib.PurePath):
+    """
+    Test that the row count is recorded when populating a database, and counted for older databases.
+    """
+    with PassageIDDatabase(str(tmp_path / TEMP_FILE)) as hdb:
+        assert hdb.populate(SAMPLE_HASHES_PATH, 5000, SAMPLE_DB_COUNT)
+        assert hdb.cached_rowcount() == SAMPLE_DB_COUNT
+        # the recorded value is returned without counting the rows
+        hdb._conn.execute(f"DELETE FROM {PassageIDDatabase.TABLE_NAME} WHERE rowid <= 10")
+        assert hdb.cached_rowcount() == SAMPLE_DB_COUNT
+
+    # the sample database file was created without a metadata table
+    hdb = PassageIDDatabase(SAMPLE_DB_PATH)
+    assert hdb.open(readonly=True)
+    assert hdb.cached_rowcount() == SAMPLE_DB_COUNT
+    hdb.close()
+
+
 def test_validation_all_valid(sample_database):
     """
     Test validating a small set of passage IDs against the sample database.
@@ -52,3 +70,82 @@ def test_validation_all_invalid(sample_database):
     valid_passage_ids = ["clueweb22-en0004-67-04151:9", "foo", "bar", "clueweb22-en0004-50-06631:20"]
     results = sample_database.validate(valid_passage_ids)
     assert results == [True, False, False, True]
+
+
+def test_validation_bulk(sample_database, sample_ids):
+    """
+    Test validating every ID in the sample database in one call, mixed with invalid IDs.
+    """
+    passage_ids = []
+    for passage_id in sample_ids:
+        passage_ids.append(passage_id)
+        passage_ids.append(passage_id + "0000")
+
+    results = sample_database.validate(passage_ids)
+    assert results == [i % 2 == 0 for i in range(len(passage_ids))]
+
+
+def test_validation_large_batch(sample_database, sample_ids):
+    """
+    Test that a batch bigger than SQLite's bound parameter limit keeps its order, including repeated IDs.
+    """
+    # 4 copies of the sample IDs in reverse order, interleaved with invalid IDs
+    passage_ids = []
+    for passage_id in reversed(sample_ids * 4):
+        passage_ids.append(passage_id)
+        passage_ids.append("foo")
+
+    results = sample_database.validate(passage_ids)
+    assert len(results) == 80000
+    assert results == [i % 2 == 0 for i in range(len(passage_ids))]
+
+
+def test_text_id_databases(tmp_path: pathlib.PurePath):
+    """
+    Test that databases storing passage IDs as text are still supported.
+    """
+    path = str(tmp_path / TEMP_FILE)
+    with PassageIDDatabase(path) as hdb:
+        assert hdb.populate(SAMPLE_HASHES_PATH, 5000, SAMPLE_DB_COUNT, schema_version=SCHEMA_TEXT_IDS)
+
+    passage_ids = ["clueweb22-en0004-67-04151:9", "foo", "clueweb22-en0004-50-06631:20"]
+    # the schema version should be read back from the file when it's reopened
+    for db_path in [path, SAMPLE_DB_PATH]:
+        with PassageIDDatabase(db_path) as hdb:
+            assert hdb.schema_version == SCHEMA_TEXT_IDS
+            assert hdb.rowcount() == SAMPLE_DB_COUNT
+            assert hdb.validate(passage_ids) == [True, False, True]
+
+
+def test_hashed_id_database(sample_database):
+    """
+    Test that new databases store hashed passage IDs.
+    """
+    assert sample_database.schema_version == SCHEMA_HASHED_IDS
+
+
+def test_populate_workers(tmp_path: pathlib.PurePath, sample_ids):
+    """
+    Test that hashing passage IDs with a pool of worker processes gives the same database.
+    """
+    with PassageIDDatabase(str(tmp_path / TEMP_FILE)) as hdb:
+        assert hdb.populate(SAMPLE_HASHES_PATH, 1000, SAMPLE_DB_COUNT, workers=2)
+        assert hdb.rowcount() == SAMPLE_DB_COUNT
+        assert hdb.validate(sample_ids + ["foo"]) == [True] * len(sample_ids) + [False]
+
+
+def test_readonly_database(tmp_path: pathlib.PurePath):
+    """
+    Test that read-only connections can do lookups but not modify the database, or create a new one.
+    """
+    hdb = PassageIDDatabase(SAMPLE_DB_PATH)
+    assert hdb.open(readonly=True)
+    assert hdb.rowcount() == SAMPLE_DB_COUNT
+    assert hdb.validate(["clueweb22-en0004-67-04151:9", "foo"]) == [True, False]
+    assert not hdb.populate(SAMPLE_HASHES_PATH, 5000, SAMPLE_DB_COUNT)
+    assert hdb.rowcount() == SAMPLE_DB_COUNT
+    hdb.close()
+
+    missing_path = tmp_path / TEMP_FILE
+    assert not PassageIDDatabase(str(missing_path)).open(readonly=True)
+    assert not os.path.exists(missing_path)
@@ -1,9 +1,11 @@
 import time
 import multiprocessing
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
+from passage_id_array import PassageIDArray
 from passage_validator import PassageValidator
 from main import validate, GRPC_DEFAULT_TIMEOUT, EXPECTED_RUN_TURN_COUNT
 
@@ -16,6 +18,28 @@ def test_service_startup(servicer_params_test):
     assert pv.db.rowcount() == servicer_params_test[1]
 
 
+def test_service_startup_array(sample_array):
+    """
+    Test that the PassageValidator service loads a passage ID array based on its file extension.
+    """
+    pv = PassageValidator(sample_array.path, sample_array.rowcount())
+    assert isinstance(pv.db, PassageIDArray)
+    assert pv.db.rowcount() == sample_array.rowcount()
+
+
+def test_service_thread_connections(servicer_params_test, sample_ids):
+    """
+    Test that each service thread gets its own database connection.
+    """
+    pv = PassageValidator(*servicer_params_test)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dbs = list(executor.map(lambda _: pv._thread_db(), range(2)))
+
+    assert dbs[0] is not pv.db
+    for db in dbs:
+        assert db.validate(sample_ids[:10]) == [True] * 10
+
+
 def test_service_startup_invalid_rows(servicer_params_test):
     """
     Test that the service fails to start if the database has an unexpected row count.
@@ -38,6 +62,7 @@ def validate_wrapper(run_file: str, file_root: str, max_warnings: int, skip_vali
 
 
 @pytest.mark.skip("Currently broken")
+@pytest.mark.xdist_group(name="grpc_full")
 def test_service_multiple_clients(default_validate_args, grpc_server_full):
     """
     Test that the service handles multiple clients.
@@ -1,14 +1,15 @@
 import pytest
 
-from compiled_protobufs.passage_validator_pb2 import PassageValidationRequest
+from compiled_protobufs.passage_validator_pb2 import PassageValidation, PassageValidationRequest, PassageValidationResult
 from compiled_protobufs.run_pb2 import PassageProvenance
-from utils import validate_passages
-from main import GRPC_DEFAULT_TIMEOUT, validate_turn, load_topic_data
+import utils
+from utils import ValidationFatal, get_passage_ids, lookup_passages, validate_passages
+from main import GRPC_DEFAULT_TIMEOUT, validate_turn
 
 
 def build_request(ids):
     request = PassageValidationRequest()
-    request.passage_ids.MergeFrom(ids)
+    request.passage_ids.extend(ids)
     return request
 
 
@@ -16,6 +17,7 @@ def get_invalid_indices(response):
     return [i for i, pv in enumerate(response.passage_validations) if not pv.is_valid]
 
 
+@pytest.mark.xdist_group(name="grpc_full")
 def test_validate_passages(grpc_stub_full, test_logger, sample_turn):
     """
     Test that a sample turn from the baseline run file validates as expected.
@@ -23,7 +25,8 @@ def test_validate_passages(grpc_stub_full, test_logger, sample_turn):
     assert validate_passages(grpc_stub_full, test_logger, sample_turn, GRPC_DEFAULT_TIMEOUT) == 0
 
 
-def test_validate_too_many_passages(grpc_stub_full, sample_turn, topic_data_file):
+@pytest.mark.xdist_group(name="grpc_full")
+def test_validate_too_many_passages(grpc_stub_full, sample_turn, topic_data):
     """
     Test that validation generates warnings when too many passages appear in a response.
     """
@@ -42,7 +45,6 @@ def test_validate_too_many_passages(grpc_stub_full, sample_turn, topic_data_file
     for i in range(num_responses):
         sample_turn.responses[i].passage_provenance.MergeFrom(passages)
 
-    topic_data = load_topic_data(topic_data_file)
     topic_id = int(sample_turn.turn_id.split("_")[0])
 
     # this should produce 2 warnings per response due to the number of passages listed being >1k
@@ -94,3 +96,57 @@ def test_empty(grpc_stub_test):
     """
     response = grpc_stub_test.validate_passages(build_request([]))
     assert len(get_invalid_indices(response)) == 0
+
+
+def test_validate_stream(grpc_stub_test, sample_ids):
+    """
+    Test that the streaming service method returns a result for each request in order.
+    """
+    requests = [build_request(["foo", "bar"]), build_request(sample_ids[:3]), build_request([]), build_request(["foo"])]
+    responses = list(grpc_stub_test.validate_passages_stream(iter(requests)))
+
+    assert [len(response.passage_validations) for response in responses] == [2, 3, 0, 1]
+    assert [get_invalid_indices(response) for response in responses] == [[0, 1], [], [], [0]]
+
+
+def test_lookup_passages(grpc_stub_test, sample_ids, monkeypatch):
+    """
+    Test that lookup_passages maps IDs to the right results when they're split over several requests.
+    """
+    monkeypatch.setattr(utils, "PASSAGE_VALIDATION_BATCH_SIZE", 7)
+    valid_ids = sample_ids[0 : len(sample_ids) : 500]
+    invalid_ids = ["foo", "bar", "foobar", "barfoo"]
+
+    passage_validity = lookup_passages(grpc_stub_test, invalid_ids + valid_ids, GRPC_DEFAULT_TIMEOUT)
+
+    assert passage_validity == {**dict.fromkeys(invalid_ids, False), **dict.fromkeys(valid_ids, True)}
+
+
+@pytest.mark.parametrize("results_per_request", [[2], [2, 2, 2], [2, 1]])
+def test_lookup_passages_missing_results(monkeypatch, results_per_request):
+    """
+    Test that lookup_passages raises ValidationFatal if the service returns the wrong number of results.
+    """
+
+    class ShortStub:
+        def validate_passages_stream(self, requests, timeout):
+            list(requests)
+            return [
+                PassageValidationResult(passage_validations=[PassageValidation(is_valid=True)] * count)
+                for count in results_per_request
+            ]
+
+    monkeypatch.setattr(utils, "PASSAGE_VALIDATION_BATCH_SIZE", 2)
+
+    with pytest.raises(ValidationFatal):
+        lookup_passages(ShortStub(), ["a", "b", "c", "d"], GRPC_DEFAULT_TIMEOUT)
+
+
+def test_get_passage_ids(sample_turn):
+    """
+    Test that get_passage_ids returns each passage ID in a turn once, in order of appearance.
+    """
+    passage_ids = get_passage_ids([sample_turn, sample_turn])
+    all_ids = [p.id for response in sample_turn.responses for p in response.passage_provenance]
+
+    assert passage_ids == list(dict.fromkeys(all_ids))
@@ -1,13 +1,30 @@
 import sys
 
 from logging import Logger
-from typing import Any
+from typing import Any, Iterable
 
 sys.path.append("./compiled_protobufs")
 from passage_validator_pb2 import PassageValidationRequest
 from passage_validator_pb2_grpc import PassageValidatorStub
 from run_pb2 import Turn, PassageProvenance, Response
 
+# the maximum number of passage IDs sent to the validation service in a single
+# streamed request. This keeps each message well below gRPC's default 4MB size
+# limit, and is small enough for the service to start checking IDs while the
+# rest are still being sent
+PASSAGE_VALIDATION_BATCH_SIZE = 10_000
+
+# the prefix all passage IDs in the collection start with
+PASSAGE_ID_PREFIX = "clueweb22-"
+
+
+class ValidationFatal(Exception):
+    """
+    Raised by the check_* functions for problems that should abort the validation.
+
+    validate_run logs the message and exits, so the checks themselves don't have to.
+    """
+
 
 def check_response(run_type: str, response: Response, logger: Logger, previous_rank: int, turn_id: str) -> int:
     """
@@ -24,54 +41,79 @@ def check_response(run_type: str, response: Response, logger: Logger, previous_r
 
     # the rank should be >= 1
     if response.rank == 0:
-        logger.warning(f"Response rank for turn {turn_id} is missing or equal to 0")
+        logger.warning("Response rank for turn %s is missing or equal to 0", turn_id)
         new_warnings += 1
 
     # rank values should increase with successive responses
     if response.rank <= previous_rank:
         logger.warning(
-            f"Current rank {response.rank} is less than or equal to previous rank {previous_rank} for turn {turn_id}. Provenance ranking may not be in descending order"
+            "Current rank %d is less than or equal to previous rank %d for turn %s. "
+            "Provenance ranking may not be in descending order",
+            response.rank,
+            previous_rank,
+            turn_id,
         )
         new_warnings += 1
 
     # the response text shouldn't be empty (unless this is an "only_response" run)
     if len(response.text) == 0 and run_type != "only_response":
-        logger.warning(f"Response text for turn {turn_id} is missing")
+        logger.warning("Response text for turn %s is missing", turn_id)
         new_warnings += 1
 
     return new_warnings
 
 
-def check_passage_provenance(prev_score: float, provenance: PassageProvenance, logger: Logger, turn_id: str) -> int:
+def check_passage_provenances(
+    passage_provenance: Iterable[PassageProvenance], logger: Logger, turn_id: str
+) -> tuple[int, int]:
     """
-    Validate a PassageProvenance entry.
+    Validate the PassageProvenance entries of a Response.
 
-    This checks if the PassageProvenance:
+    This checks if each PassageProvenance:
      - has a score below that of the previous entry
      - has a 'clueweb22-' prefix on the passage ID
      - has a single colon in the passage ID
 
-    Return value is the number of warnings generated.
+    The entries are all checked in one loop rather than with a function call for
+    each of them, since a response can have up to 1000 of them.
+
+    Return value is a tuple of (number of warnings generated, number of entries marked as used).
     """
     new_warnings = 0
-
-    # the scores should decrease with each entry
-    if provenance.score > prev_score:
-        logger.warning(
-            f"Provenance entry with ID {provenance.id} in turn {turn_id} has a greater score than the previous passage ({provenance.score} > {prev_score}). Ranking order for turn {turn_id} not correct"
-        )
-        new_warnings += 1
-
-    # check the passage ID seems sensible
-    if not provenance.id.startswith("clueweb22-"):
-        logger.warning(f'{provenance.id} does not have a "clueweb22-" prefix, may be invalid')
-        new_warnings += 1
-
-    if len(provenance.id.split(":")) != 2:
-        logger.warning(f"{provenance.id} seems to be formatted incorrectly (missing/extra colons?)")
-        new_warnings += 1
-
-    return new_warnings
+    passages_used = 0
+    prev_score = 1e9
+
+    for provenance in passage_provenance:
+        passage_id = provenance.id
+        score = provenance.score
+
+        # the scores should decrease with each entry
+        if score > prev_score:
+            logger.warning(
+                "Provenance entry with ID %s in turn %s has a greater score than the previous passage (%s > %s). "
+                "Ranking order for turn %s not correct",
+                passage_id,
+                turn_id,
+                score,
+                prev_score,
+                turn_id,
+            )
+            new_warnings += 1
+
+        # check the passage ID seems sensible
+        if not passage_id.startswith(PASSAGE_ID_PREFIX):
+            logger.warning('%s does not have a "%s" prefix, may be invalid', passage_id, PASSAGE_ID_PREFIX)
+            new_warnings += 1
+
+        # count doesn't create a list like split(":") would
+        if passage_id.count(":") != 1:
+            logger.warning("%s seems to be formatted incorrectly (missing/extra colons?)", passage_id)
+            new_warnings += 1
+
+        prev_score = score
+        passages_used += provenance.used
+
+    return new_warnings, passages_used
 
 
 def check_ptkb_provenance(ptkb_prov: int, turn: Turn, ptkbs: dict[str, Any], logger: Logger) -> int:
@@ -82,49 +124,102 @@ def check_ptkb_provenance(ptkb_prov: int, turn: Turn, ptkbs: dict[str, Any], log
      - greater than 0
      - less than the total number of entries in the PTKB
 
-    Either of these conditions not being met generates an error.
+    Either of these conditions not being met raises ValidationFatal.
 
     Return value is the number of warnings generated.
     """
     new_warnings = 0
 
     if ptkb_prov < 0 or ptkb_prov > len(ptkbs):
-        logger.error(f"A PTKB provenance ID {ptkb_prov} is outside the valid range (1--{len(ptkbs)})")
-        sys.exit(255)
+        raise ValidationFatal(f"A PTKB provenance ID {ptkb_prov} is outside the valid range (1--{len(ptkbs)})")
 
     return new_warnings
 
 
-def validate_passages(passage_validation_client: PassageValidatorStub, logger: Logger, turn: Turn, timeout: float) -> int:
+def get_passage_ids(turns: Iterable[Turn]) -> list[str]:
     """
-    Validate passage IDs using the gRPC validation service.
+    Return the unique passage IDs referenced by the responses in a sequence of Turns.
 
-    Constructs a list of all the unique passage IDs referenced in the given Turn,
-    and packages them as a PassageValidationRequest. The request is sent to the
-    validation service, and the result is checked for any invalid IDs.
+    The IDs are returned in the order they first appear.
+    """
+    # dict keys are used instead of a set to keep the order consistent between calls
+    return list(
+        dict.fromkeys(
+            provenance.id
+            for turn in turns
+            for response in turn.responses
+            for provenance in response.passage_provenance
+        )
+    )
 
-    Return values is the number of passage IDs found to be invalid.
+
+def lookup_passages(
+    passage_validation_client: PassageValidatorStub, passage_ids: list[str], timeout: float
+) -> dict[str, bool]:
     """
-    passage_validation_request = PassageValidationRequest()
+    Check a list of passage IDs using the gRPC validation service.
 
-    # build a list of passage IDs, filtering out duplicates
-    passage_ids_set = set()
-    for response in turn.responses:
-        for provenance in response.passage_provenance:
-            passage_ids_set.add(provenance.id)
-    passage_ids: list[str] = list(passage_ids_set)
+    The IDs are streamed to the service in requests of up to PASSAGE_VALIDATION_BATCH_SIZE
+    IDs over a single call, and the service streams back a result for each request
+    as it's checked. This lets a whole run be checked with one call without building
+    one very large message. <timeout> applies to each request, so the deadline for
+    the whole call grows with the number of requests.
 
-    # call the validator service
-    passage_validation_request.passage_ids.MergeFrom(passage_ids)
-    passage_validation_result = passage_validation_client.validate_passages(passage_validation_request, timeout=timeout)
+    Raises ValidationFatal if the service doesn't return one result per request and
+    passage ID.
 
-    # check if any passage IDs failed to validate
-    invalid_indexes = [
-        i
-        for i, passage_validation in enumerate(passage_validation_result.passage_validations)
-        if not passage_validation.is_valid
+    Return value is a dict mapping each passage ID to True (valid) or False (invalid).
+    """
+    batches = [
+        passage_ids[i : i + PASSAGE_VALIDATION_BATCH_SIZE]
+        for i in range(0, len(passage_ids), PASSAGE_VALIDATION_BATCH_SIZE)
     ]
-    for index in invalid_indexes:
-        logger.warning(f"Provenance with ID {passage_ids[index]} does not exist in the passage collection")
+    requests = (PassageValidationRequest(passage_ids=batch) for batch in batches)
+    passage_validation_results = list(
+        passage_validation_client.validate_passages_stream(requests, timeout=timeout * max(1, len(batches)))
+    )
+
+    # the service returns one result per request, in the same order
+    if len(passage_validation_results) != len(batches):
+        raise ValidationFatal(
+            f"Validation service returned {len(passage_validation_results)} results for {len(batches)} requests"
+        )
+
+    passage_validity: dict[str, bool] = {}
+    for batch, passage_validation_result in zip(batches, passage_validation_results, strict=True):
+        if len(passage_validation_result.passage_validations) != len(batch):
+            raise ValidationFatal(
+                f"Validation service returned {len(passage_validation_result.passage_validations)} results "
+                f"for {len(batch)} passage IDs"
+            )
 
-    return len(invalid_indexes)
+        for passage_id, passage_validation in zip(batch, passage_validation_result.passage_validations, strict=True):
+            passage_validity[passage_id] = passage_validation.is_valid
+
+    return passage_validity
+
+
+def check_passages(passage_validity: dict[str, bool], logger: Logger, turn: Turn) -> int:
+    """
+    Check the passage IDs referenced in a Turn against the results from lookup_passages.
+
+    Return value is the number of passage IDs found to be invalid.
+    """
+    invalid_ids = [passage_id for passage_id in get_passage_ids([turn]) if not passage_validity[passage_id]]
+    for passage_id in invalid_ids:
+        logger.warning("Provenance with ID %s does not exist in the passage collection", passage_id)
+
+    return len(invalid_ids)
+
+
+def validate_passages(passage_validation_client: PassageValidatorStub, logger: Logger, turn: Turn, timeout: float) -> int:
+    """
+    Validate passage IDs using the gRPC validation service.
+
+    Constructs a list of all the unique passage IDs referenced in the given Turn,
+    sends them to the validation service, and checks the result for any invalid IDs.
+
+    Return values is the number of passage IDs found to be invalid.
+    """
+    passage_validity = lookup_passages(passage_validation_client, get_passage_ids([turn]), timeout)
+    return check_passages(passage_validity, logger, turn)